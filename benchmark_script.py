@@ -0,0 +1,395 @@
+#!/bin/env python3
+
+# ソースフォントをサブセット化したフィクスチャでビルドを繰り返し、
+# 処理段階ごとの所要時間とピークメモリ使用量を計測する
+
+import configparser
+import json
+import os
+import shlex
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from fontTools import subset, ttLib
+
+from build_script import default_fontforge_command
+
+# iniファイルを読み込む
+settings = configparser.ConfigParser()
+settings.read("build.ini", encoding="utf-8")
+
+JP_FONT = settings.get("DEFAULT", "JP_FONT")
+ENG_FONT = settings.get("DEFAULT", "ENG_FONT")
+ENG_FONT_35 = settings.get("DEFAULT", "ENG_FONT_35")
+SOURCE_FONTS_DIR = settings.get("DEFAULT", "SOURCE_FONTS_DIR")
+IDEOGRAPHIC_SPACE = settings.get("DEFAULT", "IDEOGRAPHIC_SPACE")
+BENCHMARK_DIR = "benchmark"
+FIXTURES_DIR = f"{BENCHMARK_DIR}/fixtures"
+RESULTS_DIR = f"{BENCHMARK_DIR}/results"
+BASELINE_PATH = f"{BENCHMARK_DIR}/baseline.json"
+
+# フィクスチャを作成するスタイル (--debug でビルドされるスタイル)
+FIXTURE_STYLE = "Regular"
+# フィクスチャに残すコードポイント
+# 各処理が個別に参照するグリフと、各処理の対象となるブロックを含める
+FIXTURE_CODEPOINTS = [
+    *range(0x0020, 0x007E + 1),  # Basic Latin
+    *range(0x00A0, 0x017F + 1),  # Latin-1 Supplement, Latin Extended-A
+    *range(0x0300, 0x036F + 1),  # Combining Diacritical Marks
+    *range(0x2000, 0x22FF + 1),  # General Punctuation ～ Mathematical Operators
+    *range(0x2500, 0x25FF + 1),  # Box Drawing, Block Elements, Geometric Shapes
+    *range(0x3000, 0x30FF + 1),  # CJK Symbols and Punctuation, Hiragana, Katakana
+    *range(0x4E00, 0x4FFF + 1),  # CJK Unified Ideographs (先頭の 512 文字)
+    0xA788,
+    *range(0xE000, 0xF8FF + 1),  # Private Use Area (Nerd Fonts)
+    *range(0xFF00, 0xFFEF + 1),  # Halfwidth and Fullwidth Forms
+]
+# サブセット化するソースフォント (SOURCE_FONTS_DIR からの相対パス)
+FIXTURE_FONTS = [
+    f"{JP_FONT}{FIXTURE_STYLE}.ttf",
+    f"{ENG_FONT}{FIXTURE_STYLE}.ttf",
+    f"{ENG_FONT_35}{FIXTURE_STYLE}.ttf",
+    "nerd-fonts/SymbolsNerdFont-Regular.ttf",
+]
+
+# 計測するケース (fontforge_script.py のオプション)
+BENCHMARK_CASES = {
+    "default": [],
+    "35-console-nerd-font": ["--35", "--console", "--nerd-font"],
+}
+# 所要時間がこの値 (ms) 未満の処理段階は誤差が大きいため退行の判定から除く
+MIN_COMPARE_MS = 10
+
+options = {}
+
+
+def main():
+    # オプション判定
+    get_options()
+    if options.get("unknown-option"):
+        usage()
+        sys.exit(1)
+
+    # スクリプトファイルがある場所で実行する
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    if options.get("make-fixtures"):
+        make_fixtures()
+        return
+
+    if not os.path.exists(f"{FIXTURES_DIR}/{FIXTURE_FONTS[0]}"):
+        print(f"Error: fixtures not found. Run {sys.argv[0]} --make-fixtures first")
+        sys.exit(1)
+
+    result = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "repeat": options["repeat"],
+        "cases": {},
+    }
+    for case in options.get("cases", BENCHMARK_CASES):
+        print(f"=== Benchmark {case} ===")
+        result["cases"][case] = run_case(case)
+
+    output_path = options.get("output") or (
+        f"{RESULTS_DIR}/{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
+    )
+    save_result(result, output_path)
+    print(f"result: {output_path}")
+
+    if options.get("save-baseline"):
+        save_result(result, BASELINE_PATH)
+        print(f"baseline: {BASELINE_PATH}")
+        return
+
+    baseline_path = options.get("baseline", BASELINE_PATH)
+    if os.path.exists(baseline_path):
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_results(result, baseline, options["threshold"])
+        if regressions:
+            print(f"{len(regressions)} regressions over {options['threshold']:.0%}")
+            sys.exit(1)
+
+
+def usage():
+    print(
+        f"Usage: {sys.argv[0]} "
+        "[--make-fixtures] [--case <NAME>] [--repeat <N>] [--fontforge <COMMAND>] "
+        "[--output <FILE>] [--baseline <FILE> | --save-baseline] "
+        "[--threshold <RATIO>]"
+    )
+    print(f"Cases: {', '.join(BENCHMARK_CASES)}")
+
+
+def get_options():
+    """オプションを取得する"""
+
+    global options
+
+    options["repeat"] = 5
+    options["threshold"] = 0.1
+    options["fontforge"] = default_fontforge_command()
+
+    args = iter(sys.argv[1:])
+    for arg in args:
+        # オプション判定
+        if arg == "--make-fixtures":
+            options["make-fixtures"] = True
+        elif arg == "--case":
+            case = next(args, None)
+            if case not in BENCHMARK_CASES:
+                options["unknown-option"] = True
+                return
+            options.setdefault("cases", []).append(case)
+        elif arg == "--repeat":
+            value = next(args, "")
+            if not value.isdecimal() or int(value) < 1:
+                options["unknown-option"] = True
+                return
+            options["repeat"] = int(value)
+        elif arg == "--fontforge":
+            value = next(args, None)
+            if value is None:
+                options["unknown-option"] = True
+                return
+            options["fontforge"] = shlex.split(value)
+        elif arg in ["--output", "--baseline"]:
+            value = next(args, None)
+            if value is None:
+                options["unknown-option"] = True
+                return
+            # 計測はスクリプトのある場所で行うため絶対パスにしておく
+            options[arg[2:]] = os.path.abspath(value)
+        elif arg == "--save-baseline":
+            options["save-baseline"] = True
+        elif arg == "--threshold":
+            try:
+                options["threshold"] = float(next(args, ""))
+            except ValueError:
+                options["unknown-option"] = True
+                return
+        else:
+            options["unknown-option"] = True
+            return
+
+
+def make_fixtures():
+    """ソースフォントをサブセット化してフィクスチャを作成する"""
+    for font_path in FIXTURE_FONTS:
+        source_path = f"{SOURCE_FONTS_DIR}/{font_path}"
+        fixture_path = f"{FIXTURES_DIR}/{font_path}"
+        if not os.path.exists(source_path):
+            print(f"Error: {source_path} not found")
+            sys.exit(1)
+        os.makedirs(os.path.dirname(fixture_path), exist_ok=True)
+
+        font = ttLib.TTFont(source_path)
+        subsetter = subset.Subsetter(subset_options())
+        subsetter.populate(unicodes=FIXTURE_CODEPOINTS)
+        subsetter.subset(font)
+        font.save(fixture_path)
+        font.close()
+        print(
+            f"{fixture_path}: {os.path.getsize(source_path)} -> "
+            f"{os.path.getsize(fixture_path)} bytes"
+        )
+
+    shutil.copyfile(
+        f"{SOURCE_FONTS_DIR}/{IDEOGRAPHIC_SPACE}", f"{FIXTURES_DIR}/{IDEOGRAPHIC_SPACE}"
+    )
+
+
+def subset_options() -> subset.Options:
+    """フィクスチャのサブセット化オプションを返す"""
+    options_ = subset.Options()
+    # ビルド処理はグリフ名・レイアウト機能・名前テーブルを参照するため、できるだけ元のまま残す
+    options_.glyph_names = True
+    options_.layout_features = ["*"]
+    options_.name_IDs = ["*"]
+    options_.name_languages = ["*"]
+    options_.notdef_outline = True
+    options_.hinting = True
+    options_.legacy_kern = True
+    return options_
+
+
+def run_case(case: str) -> dict:
+    """フィクスチャを使って Regular のビルドを繰り返し、計測結果を集計する"""
+    work_dir = tempfile.mkdtemp(prefix="notonoto-benchmark-")
+    try:
+        prepare_work_dir(work_dir)
+        runs = []
+        for i in range(options["repeat"]):
+            trace_path = f"{work_dir}/trace-{i}.json"
+            start = time.perf_counter()
+            run_command(
+                [
+                    *options["fontforge"],
+                    "fontforge_script.py",
+                    "--debug",
+                    "--no-cache",
+                    "--trace",
+                    trace_path,
+                    *BENCHMARK_CASES[case],
+                ],
+                work_dir,
+            )
+            run_command(
+                [
+                    sys.executable,
+                    "fonttools_script.py",
+                    "--no-cache",
+                    "--trace",
+                    trace_path,
+                ],
+                work_dir,
+            )
+            elapsed = time.perf_counter() - start
+            print(f"[{i + 1}/{options['repeat']}] {elapsed:.2f}s")
+            runs.append((elapsed, load_trace(trace_path)))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return summarize_runs(runs)
+
+
+def prepare_work_dir(work_dir: str):
+    """スクリプトをコピーし、フィクスチャを参照する build.ini を作成する"""
+    for filename in os.listdir("."):
+        if filename.endswith(".py"):
+            shutil.copy(filename, work_dir)
+
+    overrides = {
+        "SOURCE_FONTS_DIR": os.path.abspath(FIXTURES_DIR),
+        "BUILD_FONTS_DIR": "build",
+        "CACHE_DIR": ".cache",
+    }
+    with open("build.ini", encoding="utf-8") as f:
+        lines = f.readlines()
+    with open(f"{work_dir}/build.ini", "w", encoding="utf-8") as f:
+        for line in lines:
+            key = line.split("=")[0].strip()
+            if key in overrides:
+                line = f"{key} = {overrides[key]}\n"
+            f.write(line)
+
+
+def run_command(command: list, work_dir: str):
+    """コマンドを実行する。失敗した場合は出力を表示して終了する"""
+    result = subprocess.run(
+        command,
+        cwd=work_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        encoding="utf-8",
+        errors="replace",
+    )
+    if result.returncode != 0:
+        print(result.stdout)
+        print(f"Error: {' '.join(command)} failed")
+        sys.exit(1)
+
+
+def load_trace(trace_path: str) -> list:
+    """Chrome trace 形式のファイルを読み込む (末尾の `]` は省略されている)"""
+    with open(trace_path, encoding="utf-8") as f:
+        content = f.read().rstrip().rstrip(",")
+    if not content.endswith("]"):
+        content += "]"
+    return json.loads(content)
+
+
+def summarize_runs(runs: list) -> dict:
+    """繰り返し計測した結果から、処理段階ごとの中央値とピークメモリ使用量を求める"""
+    stage_runs = {}
+    for _, events in runs:
+        # 処理段階は「スクリプト名:段階名」で区別する
+        scripts = {
+            event["pid"]: event["args"]["name"].split(" ")[0]
+            for event in events
+            if event.get("ph") == "M" and event.get("name") == "process_name"
+        }
+        stages = {}
+        for event in events:
+            if event.get("ph") != "X":
+                continue
+            name = f"{scripts.get(event['pid'], '?')}:{event['name']}"
+            stage = stages.setdefault(
+                name,
+                {
+                    "ms": 0,
+                    "cpu_ms": 0,
+                    "cumulative_peak_rss_mb": 0,
+                    "peak_rss_growth_mb": 0,
+                },
+            )
+            # 1回のビルドで複数回実行される処理段階は合計する
+            stage["ms"] += event["dur"] / 1000
+            stage["cpu_ms"] += event["args"].get("cpu_ms") or 0
+            stage["cumulative_peak_rss_mb"] = max(
+                stage["cumulative_peak_rss_mb"],
+                event["args"].get("cumulative_peak_rss_mb") or 0,
+            )
+            stage["peak_rss_growth_mb"] += event["args"].get("peak_rss_growth_mb") or 0
+        for name, stage in stages.items():
+            stage_runs.setdefault(name, []).append(stage)
+
+    return {
+        "total": {"ms": round(statistics.median(run[0] for run in runs) * 1000, 1)},
+        "stages": {
+            name: {
+                "ms": round(statistics.median(stage["ms"] for stage in stages), 1),
+                "cpu_ms": round(
+                    statistics.median(stage["cpu_ms"] for stage in stages), 1
+                ),
+                "cumulative_peak_rss_mb": max(
+                    stage["cumulative_peak_rss_mb"] for stage in stages
+                ),
+                "peak_rss_growth_mb": round(
+                    max(stage["peak_rss_growth_mb"] for stage in stages), 1
+                ),
+            }
+            for name, stages in sorted(stage_runs.items())
+        },
+    }
+
+
+def save_result(result: dict, path: str):
+    """計測結果を JSON で保存する"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+        f.write("\n")
+
+
+def compare_results(result: dict, baseline: dict, threshold: float) -> list:
+    """基準の計測結果と比較して表示し、閾値を超えて遅くなった処理段階を返す"""
+    regressions = []
+    for case, case_result in result["cases"].items():
+        baseline_case = baseline.get("cases", {}).get(case)
+        if baseline_case is None:
+            continue
+        print(f"=== Compare {case} ===")
+        rows = [("total", case_result["total"], baseline_case["total"])]
+        for name, stage in case_result["stages"].items():
+            if name in baseline_case["stages"]:
+                rows.append((name, stage, baseline_case["stages"][name]))
+        for name, stage, baseline_stage in rows:
+            ratio = stage["ms"] / baseline_stage["ms"] if baseline_stage["ms"] else 1
+            regressed = ratio > 1 + threshold and baseline_stage["ms"] >= MIN_COMPARE_MS
+            print(
+                f"{'!' if regressed else ' '} {name:<45} "
+                f"{baseline_stage['ms']:>10.1f}ms -> {stage['ms']:>10.1f}ms "
+                f"({ratio - 1:+.1%})"
+            )
+            if regressed:
+                regressions.append((case, name))
+    return regressions
+
+
+if __name__ == "__main__":
+    main()
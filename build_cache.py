@@ -0,0 +1,151 @@
+#!/bin/env python3
+
+# ビルド中間ファイルをハッシュ値をキーにしてキャッシュする
+# fontforge_script.py (ffpython) と fonttools_script.py の両方から使うため標準ライブラリのみに依存する
+
+import configparser
+import hashlib
+import os
+import shutil
+
+# iniファイルを読み込む
+settings = configparser.ConfigParser()
+settings.read("build.ini", encoding="utf-8")
+
+CACHE_DIR = settings.get("DEFAULT", "CACHE_DIR")
+CACHE_MAX_SIZE_MB = int(settings.get("DEFAULT", "CACHE_MAX_SIZE_MB"))
+
+
+def file_digest(path: str) -> str:
+    """ファイル内容の SHA-256 を返す"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(*parts) -> str:
+    """キーの構成要素からキャッシュキーを作成する"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = repr(part).encode("utf-8")
+        # 要素の区切りが曖昧にならないよう長さを前置する
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def entry_dir(namespace: str, key: str) -> str:
+    """キャッシュエントリのディレクトリを返す"""
+    return f"{CACHE_DIR}/{namespace}/{key[:2]}/{key}"
+
+
+def fetch(namespace: str, key: str, files: dict) -> bool:
+    """キャッシュされたファイルを取り出す。
+    files は {キャッシュ内のファイル名: コピー先パス}。全て揃っている場合のみ True を返す。"""
+    entry = entry_dir(namespace, key)
+    if not os.path.isdir(entry):
+        return False
+    try:
+        for name, dest_path in files.items():
+            # 後続処理がファイルを上書きすることがあるため、ハードリンクではなくコピーする
+            shutil.copyfile(f"{entry}/{name}", dest_path)
+        # LRU 判定のために最終利用日時を更新する
+        os.utime(entry)
+    except OSError:
+        # 他プロセスによる削除と競合した場合などはキャッシュなしとして扱う
+        for dest_path in files.values():
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+        return False
+    return True
+
+
+def store(namespace: str, key: str, files: dict, replace: bool = False):
+    """ファイルをキャッシュに格納する。files は {キャッシュ内のファイル名: コピー元パス}。
+    replace が True の場合は既存のエントリを置き換える。"""
+    entry = entry_dir(namespace, key)
+    if os.path.isdir(entry) and not replace:
+        return
+    # 格納途中のエントリを他プロセスから参照されないよう、一時ディレクトリに書いてからリネームする
+    tmp_entry = f"{entry}.tmp-{os.getpid()}"
+    os.makedirs(tmp_entry, exist_ok=True)
+    for name, src_path in files.items():
+        shutil.copyfile(src_path, f"{tmp_entry}/{name}")
+    if replace and os.path.isdir(entry):
+        old_entry = f"{entry}.tmp-old-{os.getpid()}"
+        try:
+            os.rename(entry, old_entry)
+        except OSError:
+            # 他プロセスが先に置き換えた
+            pass
+        else:
+            shutil.rmtree(old_entry, ignore_errors=True)
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # 他プロセスが先に格納した
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+    evict()
+
+
+def fetch_data(namespace: str, key: str, name: str):
+    """キャッシュされたファイルの内容をバイト列で返す。存在しない場合は None"""
+    entry = entry_dir(namespace, key)
+    try:
+        with open(f"{entry}/{name}", "rb") as f:
+            data = f.read()
+        os.utime(entry)
+    except OSError:
+        return None
+    return data
+
+
+def store_data(namespace: str, key: str, name: str, data: bytes):
+    """バイト列をキャッシュに格納する"""
+    entry = entry_dir(namespace, key)
+    if os.path.isdir(entry):
+        return
+    tmp_entry = f"{entry}.tmp-{os.getpid()}"
+    os.makedirs(tmp_entry, exist_ok=True)
+    with open(f"{tmp_entry}/{name}", "wb") as f:
+        f.write(data)
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+    evict()
+
+
+def evict(max_size_mb: int = CACHE_MAX_SIZE_MB):
+    """キャッシュの合計サイズが上限を超えている場合、最後に使われた日時が古いエントリから削除する"""
+    if max_size_mb < 0 or not os.path.isdir(CACHE_DIR):
+        # 負の値の場合は無制限
+        return
+
+    entries = []
+    total_size = 0
+    for namespace in os.scandir(CACHE_DIR):
+        if not namespace.is_dir():
+            continue
+        for prefix in os.scandir(namespace.path):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                if ".tmp-" in entry.name or not entry.is_dir():
+                    continue
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                except OSError:
+                    continue
+                total_size += size
+
+    max_size = max_size_mb * 1024 * 1024
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total_size -= size
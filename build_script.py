@@ -0,0 +1,755 @@
+#!/bin/env python3
+
+# fontforge_script.py と fonttools_script.py をバリエーション×ウェイト単位のジョブに分解し、
+# 並列に実行してリリースファイル一式を作成する
+
+import configparser
+import glob
+import json
+import os
+import shlex
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+import build_trace
+
+# iniファイルを読み込む
+settings = configparser.ConfigParser()
+settings.read("build.ini", encoding="utf-8")
+
+VERSION = settings.get("DEFAULT", "VERSION")
+FONT_NAME = settings.get("DEFAULT", "FONT_NAME")
+BUILD_FONTS_DIR = settings.get("DEFAULT", "BUILD_FONTS_DIR")
+CACHE_DIR = settings.get("DEFAULT", "CACHE_DIR")
+W35_WIDTH_STR = settings.get("DEFAULT", "W35_WIDTH_STR")
+CONSOLE_STR = settings.get("DEFAULT", "CONSOLE_STR")
+HIDDEN_ZENKAKU_SPACE_STR = settings.get("DEFAULT", "HIDDEN_ZENKAKU_SPACE_STR")
+NERD_FONTS_STR = settings.get("DEFAULT", "NERD_FONTS_STR")
+RELEASE_FILES_DIR = "release_files"
+LOG_DIR = f"{BUILD_FONTS_DIR}/log"
+# ジョブの種類ごとのピークメモリ使用量の記録
+JOB_STATS_PATH = f"{CACHE_DIR}/job_stats.json"
+# オプションとウェイトごとのジョブの所要時間の記録
+JOB_DURATIONS_PATH = f"{CACHE_DIR}/job_durations.json"
+# fontforge_script.py の常駐モードが起動時に作成する接続認証キーのファイル (fontforge_script.py と同じパス)
+SERVER_AUTHKEY_PATH = f"{CACHE_DIR}/fontforge-server.key"
+
+# fontforge_script.py の STYLES と同じ並び
+STYLES = [
+    "Regular",
+    "Thin",
+    "ExtraLight",
+    "Light",
+    "Medium",
+    "SemiBold",
+    "Bold",
+    "ExtraBold",
+    "Black",
+]
+
+# ビルドするバリエーション (fontforge_script.py のオプション)
+VARIANT_OPTIONS = [
+    [],  # 通常版
+    ["--35"],  # 3:5幅版
+    ["--console"],  # コンソール用 通常版
+    ["--console", "--35"],  # コンソール用 3:5幅版
+    ["--hidden-zenkaku-space"],  # 通常版 全角スペース不可視
+    ["--hidden-zenkaku-space", "--35"],  # 3:5幅版 全角スペース不可視
+    ["--hidden-zenkaku-space", "--console"],  # コンソール用 通常版 全角スペース不可視
+    [
+        "--hidden-zenkaku-space",
+        "--console",
+        "--35",
+    ],  # コンソール用 3:5幅版 全角スペース不可視
+]
+# --nerd-font 指定時に追加するバリエーション
+NERD_FONT_VARIANT_OPTIONS = [
+    ["--console", "--nerd-font"],  # コンソール用 通常版 + Nerd Fonts
+    ["--console", "--35", "--nerd-font"],  # コンソール用 3:5幅版 + Nerd Fonts
+]
+
+# リリースフォルダへの振り分け (先に一致したものが優先される)
+# (ファイルパターン, フォルダ名, フォルダ名に付ける接尾辞)
+RELEASE_FOLDERS = [
+    (
+        f"{FONT_NAME}*{NERD_FONTS_STR}*-*.ttf",
+        f"{FONT_NAME}_{NERD_FONTS_STR}_{VERSION}",
+        NERD_FONTS_STR,
+    ),
+    (
+        f"{FONT_NAME}*{HIDDEN_ZENKAKU_SPACE_STR}*-*.ttf",
+        f"{FONT_NAME}_{HIDDEN_ZENKAKU_SPACE_STR}_{VERSION}",
+        HIDDEN_ZENKAKU_SPACE_STR,
+    ),
+    (f"{FONT_NAME}*-*.ttf", f"{FONT_NAME}_{VERSION}", ""),
+]
+# 可変フォントで補間できなかったグリフの一覧の接尾辞 (fonttools_script.py と同じ値)
+# 一覧はフォントと同じフォルダに移動する
+INCOMPATIBLE_REPORT_SUFFIX = "-incompatible.txt"
+RELEASE_FAMILY_FOLDERS = [
+    (f"*{W35_WIDTH_STR}{CONSOLE_STR}*.ttf", f"{FONT_NAME}{W35_WIDTH_STR}{CONSOLE_STR}"),
+    (f"*{CONSOLE_STR}*.ttf", f"{FONT_NAME}{CONSOLE_STR}"),
+    (f"*{W35_WIDTH_STR}*.ttf", f"{FONT_NAME}{W35_WIDTH_STR}"),
+    ("*.ttf", FONT_NAME),
+]
+
+# ピークメモリ使用量の記録がないジョブの種類の見積もり (MB)
+DEFAULT_JOB_MEMORY_MB = {
+    "fontforge": 3072,
+    "fontforge-nerd": 4096,
+    "fonttools": 1536,
+    "variable": 8192,
+}
+# 所要時間の記録がないジョブの種類の見積もり (秒)
+DEFAULT_JOB_SECONDS = {
+    "fontforge": 300,
+    "fontforge-nerd": 600,
+    "fonttools": 60,
+    "variable": 300,
+}
+# 所要時間の予測に使う直近の記録の件数
+JOB_DURATION_SAMPLES = 5
+# 既定のメモリ使用量の上限 (搭載メモリに対する割合)
+DEFAULT_MEMORY_BUDGET_RATIO = 0.8
+
+options = {}
+
+
+def main():
+    # オプション判定
+    get_options()
+    if options.get("unknown-option"):
+        usage()
+        sys.exit(1)
+
+    # スクリプトファイルがある場所で実行する
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    # buildディレクトリを作り直す
+    if os.path.exists(BUILD_FONTS_DIR):
+        shutil.rmtree(BUILD_FONTS_DIR)
+    os.makedirs(LOG_DIR)
+
+    if options.get("trace"):
+        # 各ジョブのプロセスが同じファイルに追記するため、前回の結果を消しておく
+        if os.path.exists(options["trace"]):
+            os.remove(options["trace"])
+        build_trace.enable(options["trace"])
+
+    jobs = make_jobs()
+    budget = options["memory-budget"]
+    print(
+        f"{len(jobs)} jobs, {options['jobs']} parallel, "
+        f"memory budget {f'{budget} MB' if budget is not None else 'unlimited'}"
+    )
+    start = time.monotonic()
+    failed = run_jobs(jobs)
+    print(f"build finished in {time.monotonic() - start:.1f}s")
+    if failed:
+        for job in failed:
+            print(f"Error: {job['name']} failed (see {job['log']})")
+        sys.exit(1)
+
+    release_dir = move_to_release_folders()
+    print(f"release files: {release_dir}")
+
+    if options.get("validate"):
+        # NumPy は検証する場合のみ必要なため、ここで読み込む
+        import validate_script
+
+        if not validate_script.validate_fonts(release_dir, options["jobs"]):
+            sys.exit(1)
+
+    if options.get("web"):
+        # fontTools は Web フォントを作成する場合のみ必要なため、ここで読み込む
+        import webfont_script
+
+        webfont_script.make_web_fonts(release_dir, options["jobs"])
+
+    if options.get("package"):
+        # Web フォントのフォルダも含めて圧縮するため、最後に行う
+        import package_script
+
+        if not package_script.make_release_archives(release_dir, options["jobs"]):
+            sys.exit(1)
+
+
+def usage():
+    print(
+        f"Usage: {sys.argv[0]} [--jobs <N>] [--nerd-font] "
+        "[--fontforge <COMMAND> | --fontforge-server <ADDRESS>] "
+        "[--memory-budget <MB>] [--variable] [--validate] [--web] [--package] "
+        "[--trace <FILE>]"
+    )
+
+
+def get_options():
+    """オプションを取得する"""
+
+    global options
+
+    options["jobs"] = os.cpu_count() or 1
+    options["fontforge"] = default_fontforge_command()
+    options["memory-budget"] = default_memory_budget()
+
+    args = iter(sys.argv[1:])
+    for arg in args:
+        # オプション判定
+        if arg == "--jobs":
+            value = next(args, "")
+            if not value.isdecimal() or int(value) < 1:
+                options["unknown-option"] = True
+                return
+            options["jobs"] = int(value)
+        elif arg == "--nerd-font":
+            options["nerd-font"] = True
+        elif arg == "--fontforge":
+            value = next(args, None)
+            if value is None:
+                options["unknown-option"] = True
+                return
+            options["fontforge"] = shlex.split(value)
+        elif arg == "--fontforge-server":
+            value = next(args, None)
+            if value is None:
+                options["unknown-option"] = True
+                return
+            options["fontforge-server"] = value
+        elif arg == "--web":
+            options["web"] = True
+        elif arg == "--package":
+            options["package"] = True
+        elif arg == "--variable":
+            options["variable"] = True
+        elif arg == "--validate":
+            options["validate"] = True
+        elif arg == "--memory-budget":
+            value = next(args, "")
+            if not value.isdecimal() or int(value) < 1:
+                options["unknown-option"] = True
+                return
+            options["memory-budget"] = int(value)
+        elif arg == "--trace":
+            value = next(args, None)
+            if value is None:
+                options["unknown-option"] = True
+                return
+            # 各ジョブはスクリプトのある場所で実行するため絶対パスにしておく
+            options["trace"] = os.path.abspath(value)
+        else:
+            options["unknown-option"] = True
+            return
+
+
+def default_fontforge_command():
+    """FontForge の Python スクリプト実行コマンドを返す"""
+    if sys.platform == "win32":
+        return [r"C:\Program Files (x86)\FontForgeBuilds\bin\ffpython.exe"]
+    if shutil.which("ffpython"):
+        return ["ffpython"]
+    return ["fontforge", "-lang=py", "-script"]
+
+
+def default_memory_budget():
+    """搭載メモリから既定のメモリ使用量の上限 (MB) を求める。取得できない場合は None (無制限)"""
+    try:
+        total_memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        # Windows など
+        return None
+    return int(total_memory / 1024 / 1024 * DEFAULT_MEMORY_BUDGET_RATIO)
+
+
+def variant_name(variant_options: list) -> str:
+    """fontforge_script.py のオプションから出力ファイル名のバリエーション部分を求める"""
+    variant = W35_WIDTH_STR if "--35" in variant_options else ""
+    variant += CONSOLE_STR if "--console" in variant_options else ""
+    variant += (
+        HIDDEN_ZENKAKU_SPACE_STR if "--hidden-zenkaku-space" in variant_options else ""
+    )
+    variant += NERD_FONTS_STR if "--nerd-font" in variant_options else ""
+    return variant
+
+
+def make_jobs() -> list:
+    """ビルド計画を立て、実行するジョブの一覧を返す。
+
+    全角スペースの可視化の有無だけが異なるバリエーションは、英語フォントが同一で日本語フォントも
+    可視化の直前までの処理が同じため、FontForge の処理を1回にまとめて両方を出力する。
+    fontTools の処理は同じ英語フォントのヒンティング結果をキャッシュで共有できるよう、
+    組の中で順番に実行する。"""
+    variant_options_list = list(VARIANT_OPTIONS)
+    if options.get("nerd-font"):
+        # 実行する順序は run_jobs で予測所要時間から決める
+        variant_options_list = variant_options_list + NERD_FONT_VARIANT_OPTIONS
+
+    # 全角スペースの可視化の有無以外のオプションが同じバリエーションをまとめる
+    groups = {}
+    for variant_options in variant_options_list:
+        shared_options = tuple(
+            option for option in variant_options if option != "--hidden-zenkaku-space"
+        )
+        groups.setdefault(shared_options, []).append(variant_options)
+
+    jobs = []
+    # ヒンティングする英語フォントは全角スペースの可視化の有無によらないため、組とウェイトごとに1つになる
+    hinting_inputs = set()
+    for shared_options, group in groups.items():
+        fontforge_options = list(shared_options)
+        if len(group) > 1:
+            fontforge_options.append("--with-hidden-zenkaku-space")
+        else:
+            fontforge_options = group[0]
+        for style in STYLES:
+            fontforge_job_name = (
+                f"fontforge_{FONT_NAME}{variant_name(fontforge_options)}-{style}"
+            )
+            fontforge_args = [
+                "--do-not-delete-build-dir",
+                *fontforge_options,
+                "--style",
+                style,
+            ]
+            fontforge_args.extend(trace_args())
+            fontforge_job = make_job(
+                fontforge_job_name,
+                [*options["fontforge"], "fontforge_script.py", *fontforge_args],
+                depends=[],
+                job_type=(
+                    "fontforge-nerd"
+                    if "--nerd-font" in fontforge_options
+                    else "fontforge"
+                ),
+                cost_key=make_cost_key("fontforge", fontforge_options, style),
+            )
+            # 常駐モードの FontForge に依頼する場合の引数
+            fontforge_job["fontforge_args"] = fontforge_args
+            jobs.append(fontforge_job)
+            # 同じ英語フォントを使う fontTools の処理は、先に実行したものの結果を後続が再利用する
+            previous_job_name = None
+            for variant_options in group:
+                hinting_inputs.add((shared_options, style))
+                variant = variant_name(variant_options)
+                fonttools_job_name = f"fonttools_{FONT_NAME}{variant}-{style}"
+                depends = [fontforge_job_name]
+                if previous_job_name is not None:
+                    depends.append(previous_job_name)
+                jobs.append(
+                    make_job(
+                        fonttools_job_name,
+                        [
+                            sys.executable,
+                            "fonttools_script.py",
+                            f"{variant}-{style}",
+                            *trace_args(),
+                        ],
+                        depends=depends,
+                        job_type="fonttools",
+                        cost_key=make_cost_key("fonttools", variant_options, style),
+                    )
+                )
+                previous_job_name = fonttools_job_name
+
+    if options.get("variable"):
+        # 全ウェイトの fontTools の処理が終わったバリエーションから可変フォントを作成する
+        for variant_options in variant_options_list:
+            variant = variant_name(variant_options)
+            jobs.append(
+                make_job(
+                    f"variable_{FONT_NAME}{variant}",
+                    [
+                        sys.executable,
+                        "fonttools_script.py",
+                        "--variable",
+                        variant,
+                        *trace_args(),
+                    ],
+                    depends=[
+                        f"fonttools_{FONT_NAME}{variant}-{style}" for style in STYLES
+                    ],
+                    job_type="variable",
+                    cost_key=make_cost_key("variable", variant_options, ""),
+                )
+            )
+
+    fontforge_jobs = [job for job in jobs if job["name"].startswith("fontforge_")]
+    font_count = len(variant_options_list) * len(STYLES)
+    print(
+        f"plan: {font_count} fonts, "
+        f"{len(fontforge_jobs)} FontForge jobs, "
+        f"{len(hinting_inputs)} distinct hinting inputs "
+        f"({font_count - len(hinting_inputs)} fonts reuse cached hinting)"
+    )
+    return jobs
+
+
+def trace_args() -> list:
+    """各スクリプトにトレースの出力先を渡す引数を返す"""
+    if options.get("trace"):
+        return ["--trace", options["trace"]]
+    return []
+
+
+def make_job(
+    name: str, command: list, depends: list, job_type: str, cost_key: str
+) -> dict:
+    """ジョブを作成する。メモリ使用量はジョブの種類ごとに、所要時間は cost_key ごとに記録・予測する"""
+    return {
+        "name": name,
+        "type": job_type,
+        "cost_key": cost_key,
+        "log": f"{LOG_DIR}/{name}.log",
+        "command": command,
+        "depends": depends,
+    }
+
+
+def make_cost_key(script: str, script_options: list, style: str) -> str:
+    """所要時間の記録のキーを作成する。オプションの順序によらないよう並べ替える。
+    例: fontforge --35 --console Regular"""
+    return " ".join([script, *sorted(script_options), style]).strip()
+
+
+def run_jobs(jobs: list) -> list:
+    """依存関係を満たしたジョブから並列に実行し、失敗したジョブを返す。
+    実行中のジョブの予測メモリ使用量の合計が上限を超えないように実行するジョブを選ぶ。"""
+    job_stats = load_job_stats()
+    job_durations = load_job_durations()
+    budget = options["memory-budget"]
+    for job in jobs:
+        job["seconds"] = predict_job_seconds(job, job_durations)
+    # 予測した所要時間が長い経路の先頭にあるジョブから実行する
+    priorities = job_priorities(jobs)
+    pending = sorted(jobs, key=lambda job: -priorities[job["name"]])
+    print(f"estimated build time {format_seconds(estimate_makespan(pending, {}))}")
+    running = {}
+    finished = set()
+    failed = []
+    failed_names = set()
+    with ThreadPoolExecutor(max_workers=options["jobs"]) as executor:
+        while pending or running:
+            used_memory = sum(job["memory"] for job in running.values())
+            for job in list(pending):
+                if len(running) >= options["jobs"]:
+                    break
+                if any(name in failed_names for name in job["depends"]):
+                    # 依存するジョブが失敗した場合は実行しない
+                    pending.remove(job)
+                    failed.append(job)
+                    failed_names.add(job["name"])
+                    continue
+                if not all(name in finished for name in job["depends"]):
+                    continue
+                job["memory"] = predict_job_memory(job, job_stats)
+                # 上限を超える場合は、より小さいジョブか実行中のジョブの終了を待つ
+                # 何も実行していない場合は、上限を超えていても1つは実行する
+                if (
+                    running
+                    and budget is not None
+                    and used_memory + job["memory"] > budget
+                ):
+                    continue
+                pending.remove(job)
+                job["start"] = time.monotonic()
+                running[executor.submit(run_job, job)] = job
+                used_memory += job["memory"]
+
+            if not running:
+                if pending:
+                    raise RuntimeError("unresolvable job dependencies")
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                returncode, elapsed, peak_rss_mb = future.result()
+                if peak_rss_mb is not None:
+                    record_job_stats(job_stats, job["type"], peak_rss_mb)
+                    memory = f", {peak_rss_mb:.0f} MB"
+                else:
+                    memory = ""
+                if is_oom_killed(returncode) and not job.get("retried"):
+                    # メモリ不足で強制終了された場合は、他のジョブと並列にせず実行し直す
+                    print(f"{job['name']} was killed, retrying alone")
+                    job["retried"] = True
+                    job["exclusive"] = True
+                    pending.insert(0, job)
+                    continue
+                ok = returncode == 0
+                if ok:
+                    finished.add(job["name"])
+                    record_job_duration(job_durations, job["cost_key"], elapsed)
+                else:
+                    failed.append(job)
+                    failed_names.add(job["name"])
+                status = "done" if ok else "FAILED"
+                eta = estimate_makespan(
+                    [
+                        pending_job
+                        for pending_job in pending
+                        if pending_job["name"] not in failed_names
+                    ],
+                    {
+                        running_job["name"]: running_job["start"]
+                        + running_job["seconds"]
+                        - time.monotonic()
+                        for running_job in running.values()
+                    },
+                )
+                print(
+                    f"[{len(finished) + len(failed)}/{len(jobs)}] "
+                    f"{job['name']} {status} ({elapsed:.1f}s{memory}), "
+                    f"eta {format_seconds(eta)}"
+                )
+    save_job_stats(job_stats)
+    save_job_durations(job_durations)
+    return failed
+
+
+def job_priorities(jobs: list) -> dict:
+    """ジョブ名 → そのジョブから依存関係をたどった最長経路の予測所要時間 (秒) の辞書を返す"""
+    dependents = {job["name"]: [] for job in jobs}
+    for job in jobs:
+        for name in job["depends"]:
+            dependents[name].append(job)
+    priorities = {}
+
+    def priority(job: dict) -> float:
+        if job["name"] not in priorities:
+            priorities[job["name"]] = job["seconds"] + max(
+                (priority(dependent) for dependent in dependents[job["name"]]),
+                default=0,
+            )
+        return priorities[job["name"]]
+
+    for job in jobs:
+        priority(job)
+    return priorities
+
+
+def estimate_makespan(pending: list, running: dict) -> float:
+    """待機中のジョブを予測所要時間で並列に実行した場合の、全ジョブが終わるまでの秒数を見積もる。
+    running は実行中のジョブ名 → 残りの予測秒数。メモリ使用量の上限は考慮しない。"""
+    finish_times = {name: max(seconds, 0) for name, seconds in running.items()}
+    workers = sorted(finish_times.values())
+    workers += [0.0] * max(options["jobs"] - len(workers), 0)
+    waiting = list(pending)
+    waiting_names = {job["name"] for job in waiting}
+    while waiting:
+        # 依存するジョブが全て実行を割り当て済みのジョブのうち、優先度が最も高いものを割り当てる
+        for job in waiting:
+            if not any(name in waiting_names for name in job["depends"]):
+                break
+        else:
+            break
+        waiting.remove(job)
+        waiting_names.discard(job["name"])
+        worker_time = workers.pop(0)
+        # 完了済みのジョブは 0 秒後に終わったものとみなす
+        start = max(
+            [worker_time] + [finish_times.get(name, 0) for name in job["depends"]]
+        )
+        finish_times[job["name"]] = start + job["seconds"]
+        workers.append(finish_times[job["name"]])
+        workers.sort()
+    return max(finish_times.values(), default=0)
+
+
+def format_seconds(seconds: float) -> str:
+    """秒数を 1h02m03s 形式の文字列にする"""
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m{seconds:02d}s"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+def predict_job_memory(job: dict, job_stats: dict) -> int:
+    """ジョブのピークメモリ使用量 (MB) を予測する"""
+    if job.get("exclusive") and options["memory-budget"] is not None:
+        # 単独で実行させるため、上限いっぱいを使うものとみなす
+        return options["memory-budget"]
+    stats = job_stats.get(job["type"])
+    if stats is not None:
+        return stats["peak_rss_mb"]
+    return DEFAULT_JOB_MEMORY_MB[job["type"]]
+
+
+def predict_job_seconds(job: dict, job_durations: dict) -> float:
+    """ジョブの所要時間 (秒) を予測する。記録がない場合はジョブの種類ごとの見積もりを使う"""
+    samples = job_durations.get(job["cost_key"])
+    if samples:
+        return statistics.median(samples)
+    return DEFAULT_JOB_SECONDS[job["type"]]
+
+
+def is_oom_killed(returncode: int) -> bool:
+    """メモリ不足で強制終了された (SIGKILL を受けた) かどうかを返す"""
+    sigkill = getattr(signal, "SIGKILL", None)
+    return sigkill is not None and returncode == -sigkill
+
+
+def load_job_stats() -> dict:
+    """ジョブの種類ごとのピークメモリ使用量の記録を読み込む"""
+    try:
+        with open(JOB_STATS_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def record_job_stats(job_stats: dict, job_type: str, peak_rss_mb: float):
+    """ジョブのピークメモリ使用量を記録する。ジョブの種類ごとに最大値を使う"""
+    stats = job_stats.setdefault(job_type, {"peak_rss_mb": 0, "samples": 0})
+    stats["peak_rss_mb"] = max(stats["peak_rss_mb"], round(peak_rss_mb))
+    stats["samples"] += 1
+
+
+def save_job_stats(job_stats: dict):
+    """ジョブの種類ごとのピークメモリ使用量の記録を保存する"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(JOB_STATS_PATH, "w", encoding="utf-8") as f:
+        json.dump(job_stats, f, indent=2)
+        f.write("\n")
+
+
+def load_job_durations() -> dict:
+    """オプションとウェイトごとのジョブの所要時間の記録を読み込む"""
+    try:
+        with open(JOB_DURATIONS_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def record_job_duration(job_durations: dict, cost_key: str, seconds: float):
+    """ジョブの所要時間を記録する。直近の JOB_DURATION_SAMPLES 件の中央値を予測に使う"""
+    samples = job_durations.setdefault(cost_key, [])
+    samples.append(round(seconds, 1))
+    del samples[:-JOB_DURATION_SAMPLES]
+
+
+def save_job_durations(job_durations: dict):
+    """オプションとウェイトごとのジョブの所要時間の記録を保存する"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(JOB_DURATIONS_PATH, "w", encoding="utf-8") as f:
+        json.dump(job_durations, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def run_job(job: dict):
+    """ジョブのコマンドを実行する。プロセスの出力はログファイルに書き出す"""
+    with build_trace.stage(job["name"]):
+        return execute_job(job)
+
+
+def execute_job(job: dict):
+    """ジョブのコマンドを実行し、終了コード・所要時間・ピークメモリ使用量 (MB) を返す。
+    ピークメモリ使用量は取得できない場合は None"""
+    start = time.monotonic()
+    if options.get("fontforge-server") and "fontforge_args" in job:
+        returncode = request_fontforge_server(job)
+        return returncode, time.monotonic() - start, None
+    with open(job["log"], "w", encoding="utf-8") as log:
+        log.write(f"$ {shlex.join(job['command'])}\n")
+        log.flush()
+        process = subprocess.Popen(job["command"], stdout=log, stderr=subprocess.STDOUT)
+        returncode, peak_rss_mb = wait_process(process)
+    return returncode, time.monotonic() - start, peak_rss_mb
+
+
+def wait_process(process: subprocess.Popen):
+    """プロセスの終了を待ち、終了コードとピークメモリ使用量 (MB) を返す"""
+    if not hasattr(os, "wait4"):
+        # Windows ではピークメモリ使用量を取得しない
+        return process.wait(), None
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # macOS はバイト単位、Linux は KB 単位
+    if sys.platform == "darwin":
+        return process.returncode, rusage.ru_maxrss / 1024 / 1024
+    return process.returncode, rusage.ru_maxrss / 1024
+
+
+def request_fontforge_server(job: dict) -> int:
+    """常駐モードの fontforge_script.py に生成を依頼し、終了コードを返す。
+    出力は常駐プロセス側でログファイルに追記される。"""
+    address = options["fontforge-server"]
+    with open(job["log"], "w", encoding="utf-8") as log:
+        log.write(
+            f"$ ({address}) fontforge_script.py {shlex.join(job['fontforge_args'])}\n"
+        )
+    try:
+        with open(SERVER_AUTHKEY_PATH, "rb") as f:
+            authkey = f.read()
+        with Client(parse_address(address), authkey=authkey) as conn:
+            conn.send(
+                {
+                    "args": job["fontforge_args"],
+                    "log": os.path.abspath(job["log"]),
+                    "cwd": os.getcwd(),
+                }
+            )
+            return conn.recv()
+    except (EOFError, OSError, AuthenticationError) as e:
+        # 接続できない場合や認証キーが異なる場合、子プロセスが応答せずに終了した場合
+        with open(job["log"], "a", encoding="utf-8") as log:
+            log.write(f"Error: fontforge server request failed: {e!r}\n")
+        return 1
+
+
+def parse_address(address: str):
+    """HOST:PORT 形式の場合は TCP、それ以外はソケットファイル (Windows では名前付きパイプ) のアドレスとみなす"""
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdecimal():
+        return host, int(port)
+    return address
+
+
+def move_to_release_folders() -> str:
+    """ビルドしたフォントをリリース用のフォルダ構成に移動する"""
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    move_dir = f"{RELEASE_FILES_DIR}/build_{timestamp}"
+
+    for pattern, folder_name, suffix in RELEASE_FOLDERS:
+        filenames = glob.glob(f"{BUILD_FONTS_DIR}/{pattern}")
+        if len(filenames) == 0:
+            continue
+        folder_path = f"{move_dir}/{folder_name}"
+        os.makedirs(folder_path, exist_ok=True)
+        for filename in filenames:
+            move_release_file(filename, folder_path)
+
+        variant = f"_{suffix}" if suffix != "" else ""
+        for family_pattern, family_folder_name in RELEASE_FAMILY_FOLDERS:
+            family_filenames = glob.glob(f"{folder_path}/{family_pattern}")
+            # ファイル件数が0件の場合はフォルダを作成しない
+            if len(family_filenames) == 0:
+                continue
+            family_folder_path = f"{folder_path}/{family_folder_name}{variant}"
+            os.makedirs(family_folder_path, exist_ok=True)
+            for filename in family_filenames:
+                move_release_file(filename, family_folder_path)
+
+    return move_dir
+
+
+def move_release_file(filename: str, folder_path: str):
+    """フォントと、あれば補間できなかったグリフの一覧をフォルダに移動する"""
+    shutil.move(filename, folder_path)
+    report_path = f"{os.path.splitext(filename)[0]}{INCOMPATIBLE_REPORT_SUFFIX}"
+    if os.path.exists(report_path):
+        shutil.move(report_path, folder_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/bin/env python3
+
+# 処理段階ごとの経過時間・CPU 時間・ピークメモリ使用量を Chrome trace 形式で記録する
+# fontforge_script.py (ffpython) と fonttools_script.py の両方から使うため標準ライブラリのみに依存する
+#
+# 並列ビルドの複数プロセスから同じファイルに追記できるよう、JSON Array Format の各イベントを
+# `{...},` の1行ずつ書き込む (この形式では末尾の `]` は省略できる)。
+# 出力したファイルは Perfetto (https://ui.perfetto.dev) や chrome://tracing で開ける。
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Windows には resource モジュールがない
+    resource = None
+
+trace_path = None
+tags = {}
+
+
+def enable(path: str):
+    """トレースの記録を有効にする。ファイルがなければ作成して配列の開始を書き込む"""
+    global trace_path
+    trace_path = path
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND)
+    except FileExistsError:
+        # 他のプロセスが作成済み
+        pass
+    else:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write("[\n")
+    # Perfetto 上でどのスクリプトのプロセスかを区別できるようにする
+    write_event(
+        {
+            "name": "process_name",
+            "ph": "M",
+            "pid": os.getpid(),
+            "args": {"name": f"{os.path.basename(sys.argv[0])} ({os.getpid()})"},
+        }
+    )
+
+
+def set_tags(**new_tags):
+    """以降のイベントに付けるタグ (バリエーション・ウェイトなど) を設定する"""
+    tags.clear()
+    tags.update(new_tags)
+
+
+@contextmanager
+def stage(name: str):
+    """with ブロック内の処理を1つの段階として記録する"""
+    if trace_path is None:
+        yield
+        return
+
+    start_ts = time.time_ns() // 1000
+    start = time.perf_counter()
+    start_cpu = time.process_time()
+    start_peak_rss_mb = peak_rss_mb()
+    try:
+        yield
+    finally:
+        end_peak_rss_mb = peak_rss_mb()
+        write_event(
+            {
+                "name": name,
+                "cat": "stage",
+                "ph": "X",
+                "ts": start_ts,
+                "dur": int((time.perf_counter() - start) * 1_000_000),
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": {
+                    **tags,
+                    "cpu_ms": round((time.process_time() - start_cpu) * 1000, 1),
+                    # プロセス開始からのピークメモリ使用量 (段階単体のピークではない)
+                    "cumulative_peak_rss_mb": end_peak_rss_mb,
+                    # 段階の実行中にピークメモリ使用量が増えた量
+                    "peak_rss_growth_mb": (
+                        round(end_peak_rss_mb - start_peak_rss_mb, 1)
+                        if end_peak_rss_mb is not None and start_peak_rss_mb is not None
+                        else None
+                    ),
+                },
+            }
+        )
+
+
+def traced(func):
+    """関数の呼び出しを、関数名の段階として記録するデコレータ"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with stage(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def write_event(event: dict):
+    """イベントを1行としてトレースファイルに追記する"""
+    if trace_path is None:
+        return
+    line = json.dumps(event, ensure_ascii=False) + ",\n"
+    # 他のプロセスの追記と混ざらないよう、1行を1回の write で書き込む
+    fd = os.open(trace_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+    try:
+        os.write(fd, line.encode("utf-8"))
+    finally:
+        os.close(fd)
+
+
+def peak_rss_mb():
+    """プロセス開始からのピークメモリ使用量 (MB) を返す。取得できない場合は None"""
+    if resource is not None:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS はバイト単位、Linux は KB 単位
+        if sys.platform == "darwin":
+            return round(peak_rss / 1024 / 1024, 1)
+        return round(peak_rss / 1024, 1)
+    return windows_peak_rss_mb()
+
+
+def windows_peak_rss_mb():
+    """Windows のピークワーキングセット (MB) を返す"""
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        get_current_process = ctypes.windll.kernel32.GetCurrentProcess
+        get_current_process.restype = wintypes.HANDLE
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(
+            get_current_process(), ctypes.byref(counters), counters.cb
+        ):
+            return None
+        return round(counters.PeakWorkingSetSize / 1024 / 1024, 1)
+    except (ImportError, AttributeError, OSError):
+        return None
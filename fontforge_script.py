@@ -3,16 +3,24 @@
 # 2つのフォントを合成する
 
 import configparser
+import json
 import math
+import multiprocessing
 import os
+import shlex
 import shutil
 import sys
+import traceback
 import uuid
 from decimal import ROUND_HALF_UP, Decimal
+from multiprocessing.connection import Listener
 
 import fontforge
 import psMat
 
+import build_cache
+import build_trace
+
 # iniファイルを読み込む
 settings = configparser.ConfigParser()
 settings.read("build.ini", encoding="utf-8")
@@ -48,8 +56,107 @@ Copyright (c) 2014, Ryan L McIntyre https://ryanlmcintyre.com
 Copyright 2024 Yuko Otawara
 """  # noqa: E501
 
+# 生成するスタイル (Regular を最初に生成する)
+STYLES = [
+    "Regular",
+    "Thin",
+    "ExtraLight",
+    "Light",
+    "Medium",
+    "SemiBold",
+    "Bold",
+    "ExtraBold",
+    "Black",
+]
+
+# 全角化する記号類 (コンソール用以外)。日本語フォントにグリフがあれば英語フォントから削除する
+NOT_CONSOLE_JP_PRIORITY_RANGES = [
+    (0x2190, 0x21FF),  # Arrows
+    (0x2200, 0x22FF),  # Mathematical Operators
+    (0x2000, 0x206F),  # General Punctuation
+    (0x2100, 0x214F),  # Letterlike Symbols
+]
+# 全角化する記号類 (コンソール用以外)。日本語フォントの有無に関わらず英語フォントから削除する
+NOT_CONSOLE_DELETE_CODEPOINTS = [
+    0x00D7,  # ×
+    0x00F7,  # ÷
+    *range(0x2500, 0x257F + 1),  # ─-╿ (Box Drawing)
+]
+# 英語フォントを優先して適用するために削除範囲から除外する
+NOT_CONSOLE_KEEP_CODEPOINTS = [
+    # 各エディタの可視化文字対策
+    0x2022,
+    0x00B7,
+    0x2024,
+    0x2219,
+    0x25D8,
+    0x25E6,
+    # 結合文音記号は英語フォントを適用
+    *range(0x0300, 0x0328 + 1),
+    # « »
+    0x00AB,
+    0x00BB,
+    # broken bar
+    0x00A6,
+]
+# --subset 指定時にも残すコードポイント (各処理が個別に参照するグリフ)
+SUBSET_REQUIRED_CODEPOINTS = [
+    *range(
+        0x0020, 0x007E + 1
+    ),  # Basic Latin (ヒンティングやメタデータの計算でも参照する)
+    *range(0x2000, 0x22FF + 1),  # General Punctuation ～ Mathematical Operators
+    *NOT_CONSOLE_DELETE_CODEPOINTS,
+    *NOT_CONSOLE_KEEP_CODEPOINTS,
+    *[0xFF08, 0xFF09, 0xFF3B, 0xFF3D, 0xFF5B, 0xFF5D],  # 全角括弧
+    0xA788,
+    0x3000,  # 全角スペース
+    0x3042,  # 全角幅の基準
+]
+# コードポイント所有マップの形式のバージョン
+# (判定処理の変更はスクリプトのハッシュ値でキーが変わるため、上げるのは形式を変更した場合のみ)
+OWNERSHIP_MAP_VERSION = 1
+
+# グリフ単位の指紋の形式のバージョン (指紋の計算方法を変更したら上げる)
+GLYPH_MANIFEST_VERSION = 3
+# 変更されたグリフがこの割合を超える場合は差し替えずに全体を生成する
+INCREMENTAL_MAX_CHANGED_RATIO = 0.3
+# 内容を FontForge の API で読み出せないルックアップの種類 (含まれる場合は差し替えずに全体を生成する)
+UNVERIFIABLE_LOOKUP_TYPES = [
+    "gsub_context",
+    "gsub_contextchain",
+    "gsub_reversecchain",
+    "gpos_context",
+    "gpos_contextchain",
+]
+
+# 出力されるフォントに影響しない build.ini の設定 (キャッシュキーに含めない)
+NON_OUTPUT_SETTINGS = ["cache_dir", "cache_max_size_mb"]
+# 出力されるフォントに影響しないオプション (キャッシュキーに含めない)
+NON_OUTPUT_OPTIONS = [
+    "do-not-delete-build-dir",
+    "debug",
+    "style",
+    "jobs",
+    "no-cache",
+    "serve",
+    "trace",
+    "verify-batched-transform",
+    "verify-incremental",
+    "publish",
+]
+
+# --publish で生成したフォントの組を知らせる行の目印 (fonttools_script.py と同じ値)
+PUBLISH_MARKER = f"@@{FONT_NAME}-PUBLISH@@"
+
+# 常駐モードの接続認証キーのファイル (build_script.py と同じパス)
+# 起動ごとにランダムなキーを作成し、所有者のみ読み書きできるファイルに保存する
+SERVER_AUTHKEY_PATH = f"{build_cache.CACHE_DIR}/fontforge-server.key"
+
 options = {}
-nerd_font = None
+# 半角幅ごとに調整済みの Nerd Font
+nerd_fonts = {}
+# 常駐モードで読み込み済みのソースフォント (パス → フォント)
+source_fonts = {}
 
 
 def main():
@@ -59,6 +166,18 @@ def main():
         usage()
         return
 
+    if options.get("serve"):
+        serve(options["serve"])
+        return
+
+    generate_fonts()
+
+
+def generate_fonts():
+    """オプションに従ってフォントを生成する"""
+    if options.get("trace"):
+        build_trace.enable(options["trace"])
+
     # buildディレクトリを作成する
     if os.path.exists(BUILD_FONTS_DIR) and not options.get("do-not-delete-build-dir"):
         shutil.rmtree(BUILD_FONTS_DIR)
@@ -66,58 +185,314 @@ def main():
     if not os.path.exists(BUILD_FONTS_DIR):
         os.mkdir(BUILD_FONTS_DIR)
 
-    # Regular スタイルを生成する
+    # 各スタイルを生成する
+    styles = target_styles()
+    if options.get("jobs", 1) > 1 and len(styles) > 1:
+        generate_fonts_in_parallel(styles)
+    else:
+        for style in styles:
+            generate_style(style)
+
+
+@build_trace.traced
+def generate_style(style):
+    """指定したスタイルのフォントを生成する。
+    ソースフォント・設定・オプションが同じ生成結果がキャッシュにあればそれを使う。"""
+    w35_str = W35_WIDTH_STR if options.get("35") else ""
+    build_trace.set_tags(
+        variant="/".join(
+            f"{w35_str}{variant_name(hidden_zenkaku_space)}".replace(" ", "")
+            for hidden_zenkaku_space in zenkaku_space_variants()
+        ),
+        weight=style,
+    )
+
+    cache_files = {}
+    for hidden_zenkaku_space in zenkaku_space_variants():
+        eng_font_path, jp_font_path = output_font_paths(style, hidden_zenkaku_space)
+        prefix = "hidden-" if hidden_zenkaku_space else ""
+        cache_files[f"{prefix}eng.ttf"] = eng_font_path
+        cache_files[f"{prefix}jp.ttf"] = jp_font_path
+
+    cache_key = None
+    if not options.get("no-cache"):
+        cache_key = make_cache_key(style)
+        if build_cache.fetch("fontforge", cache_key, cache_files):
+            print(f"=== Generate {style} (cached) ===")
+            for hidden_zenkaku_space in zenkaku_space_variants():
+                publish_fonts(*output_font_paths(style, hidden_zenkaku_space))
+            return
+
     generate_font(
-        jp_style="Regular",
-        eng_style="Regular",
-        merged_style="Regular",
+        jp_style=style,
+        eng_style=style,
+        merged_style=style,
     )
 
-    if options.get("debug"):
-        # デバッグモードの場合はここで終了
-        return
+    if cache_key is not None:
+        build_cache.store("fontforge", cache_key, cache_files)
 
-    # 各スタイルを生成する
-    for style in [
-        "Thin",
-        "ExtraLight",
-        "Light",
-        "Medium",
-        "SemiBold",
-        "Bold",
-        "ExtraBold",
-        "Black",
-    ]:
-        # Thin スタイルを生成する
-        generate_font(
-            jp_style=style,
-            eng_style=style,
-            merged_style=style,
+
+def make_cache_key(style):
+    """生成結果に影響する入力からキャッシュキーを作成する"""
+    source_paths = list(source_font_paths(style, style))
+    if False in zenkaku_space_variants():
+        source_paths.append(f"{SOURCE_FONTS_DIR}/{IDEOGRAPHIC_SPACE}")
+    if options.get("nerd-font"):
+        source_paths.append(
+            f"{SOURCE_FONTS_DIR}/nerd-fonts/SymbolsNerdFont-Regular.ttf"
         )
 
+    return build_cache.make_key(
+        style,
+        [build_cache.file_digest(path) for path in source_paths],
+        sorted(
+            (key, value)
+            for key, value in settings.items("DEFAULT")
+            if key not in NON_OUTPUT_SETTINGS
+        ),
+        sorted(
+            (key, value)
+            for key, value in options.items()
+            if key not in NON_OUTPUT_OPTIONS
+        ),
+        # スクリプトの変更と FontForge のバージョン違いでキャッシュを無効にする
+        build_cache.file_digest(__file__),
+        fontforge.version(),
+    )
+
+
+def source_font_paths(jp_style, eng_style):
+    """合成する日本語フォントと英語フォントのソースのパスを返す"""
+    jp_font_path = f"{SOURCE_FONTS_DIR}/{JP_FONT}{jp_style}.ttf"
+    if options.get("35"):
+        eng_font_path = f"{SOURCE_FONTS_DIR}/{ENG_FONT_35}{eng_style}.ttf"
+    else:
+        eng_font_path = f"{SOURCE_FONTS_DIR}/{ENG_FONT}{eng_style}.ttf"
+    return jp_font_path, eng_font_path
+
+
+def zenkaku_space_variants():
+    """生成する全角スペース不可視版かどうかの一覧を返す。
+    --with-hidden-zenkaku-space の場合は不可視版と可視版の両方を、不可視版から順に生成する。"""
+    if options.get("with-hidden-zenkaku-space"):
+        return [True, False]
+    return [bool(options.get("hidden-zenkaku-space"))]
+
+
+def variant_name(hidden_zenkaku_space):
+    """オプション毎の修飾子を返す"""
+    variant = f"{CONSOLE_STR} " if options.get("console") else ""
+    variant += HIDDEN_ZENKAKU_SPACE_STR if hidden_zenkaku_space else ""
+    variant += NERD_FONTS_STR if options.get("nerd-font") else ""
+    return variant.strip()
+
+
+def output_font_paths(merged_style, hidden_zenkaku_space):
+    """生成する英語フォントと日本語フォントのパスを返す"""
+    w35_str = W35_WIDTH_STR if options.get("35") else ""
+    variant = variant_name(hidden_zenkaku_space)
+    name_base = f"{BUILD_FONTS_DIR}/{FONTFORGE_PREFIX}{FONT_NAME}{w35_str}{variant}-{merged_style}".replace(
+        " ", ""
+    )
+    return f"{name_base}-eng.ttf", f"{name_base}-jp.ttf"
+
+
+def generate_fonts_in_parallel(styles):
+    """スタイルごとにワーカープロセスを分けて並列に生成する"""
+    with multiprocessing.Pool(
+        processes=min(options["jobs"], len(styles)),
+        initializer=init_worker,
+        initargs=(options,),
+    ) as pool:
+        pool.map(generate_style, styles, chunksize=1)
+
+
+def init_worker(worker_options):
+    """ワーカープロセスのグローバル変数を初期化する"""
+    global options, nerd_fonts
+    # spawn で起動した場合はオプションが未設定のため親プロセスから引き継ぐ
+    options = worker_options
+    # Nerd Fonts のキャッシュはプロセスごとに持つ
+    nerd_fonts = {}
+    if options.get("trace"):
+        build_trace.enable(options["trace"])
+
+
+def serve(address):
+    """常駐モード。ソースフォントを読み込んだまま待機し、リクエストごとに fork した子プロセスで生成する。
+    子プロセスは読み込み済みのフォントをコピーオンライトで複製して使うため、
+    ソースフォントの読み込みはウェイトごとに1回で済む。"""
+    if not hasattr(os, "fork"):
+        print("Error: --serve is not supported on this platform")
+        sys.exit(1)
+
+    with Listener(parse_address(address), authkey=make_server_authkey()) as listener:
+        print(f"serving on {listener.address}", flush=True)
+        while True:
+            try:
+                conn = listener.accept()
+            except (multiprocessing.AuthenticationError, OSError):
+                # 認証キーが異なる接続などは無視する
+                continue
+            # 終了した子プロセスを回収する
+            reap_children()
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                conn.close()
+                continue
+            if request == "shutdown":
+                conn.close()
+                break
+            pid = fork_request(conn, request)
+            print(f"request {pid}: {shlex.join(request['args'])}", flush=True)
+            # 応答は子プロセスが返す
+            conn.close()
+        reap_children(block=True)
+
+
+def make_server_authkey():
+    """常駐モードの接続認証キーを作成し、所有者のみ読み書きできるファイルに保存する"""
+    authkey = os.urandom(32)
+    os.makedirs(os.path.dirname(SERVER_AUTHKEY_PATH), exist_ok=True)
+    fd = os.open(SERVER_AUTHKEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # 既にファイルがあった場合も権限を絞る
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(authkey)
+    return authkey
+
+
+def parse_address(address):
+    """HOST:PORT 形式の場合は TCP、それ以外はソケットファイル (Windows では名前付きパイプ) のアドレスとみなす"""
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdecimal():
+        return host, int(port)
+    return address
+
+
+def reap_children(block=False):
+    """終了した子プロセスを回収する"""
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, 0 if block else os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+
+
+def fork_request(conn, request):
+    """リクエストに必要なソースフォントを読み込んでから、生成を行う子プロセスを起動する"""
+    server_options = dict(options)
+    server_cwd = os.getcwd()
+    options.clear()
+    try:
+        # --subset のファイルなどの相対パスはリクエスト元のディレクトリから解決する
+        os.chdir(request.get("cwd", server_cwd))
+        get_options(request["args"])
+    except OSError:
+        options["unknown-option"] = True
+    finally:
+        os.chdir(server_cwd)
+    request_options = dict(options)
+    paths = []
+    if not request_options.get("unknown-option"):
+        for style in target_styles():
+            paths.extend(source_font_paths(style, style))
+    options.clear()
+    options.update(server_options)
+
+    # 子プロセスに引き継ぐため、親プロセスで読み込んでおく
+    for path in paths:
+        if path not in source_fonts and os.path.exists(path):
+            print(f"load {path}", flush=True)
+            source_fonts[path] = load_source_font(path)
+
+    pid = os.fork()
+    if pid == 0:
+        run_request(conn, request, request_options)
+    return pid
+
+
+def run_request(conn, request, request_options):
+    """子プロセスでリクエストを処理し、終了コードを返して終了する"""
+    status = 1
+    try:
+        os.chdir(request.get("cwd", os.getcwd()))
+        if request.get("log"):
+            # 出力はリクエスト元が指定したログファイルに追記する
+            sys.stdout.flush()
+            sys.stderr.flush()
+            log_fd = os.open(request["log"], os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+            os.dup2(log_fd, 1)
+            os.dup2(log_fd, 2)
+            os.close(log_fd)
+        options.clear()
+        options.update(request_options)
+        if options.get("unknown-option") or options.get("serve"):
+            usage()
+        else:
+            generate_fonts()
+            status = 0
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            conn.send(status)
+            conn.close()
+        except OSError:
+            pass
+        # 親プロセスから引き継いだ終了処理 (ソケットファイルの削除など) を実行しない
+        os._exit(status)
+
+
+def target_styles():
+    """生成対象のスタイルを返す"""
+    if options.get("style"):
+        # スタイル指定がある場合はそのスタイルのみ
+        return [options["style"]]
+    if options.get("debug"):
+        # デバッグモードの場合は Regular のみ
+        return ["Regular"]
+    return STYLES
+
 
 def usage():
     print(
         f"Usage: {sys.argv[0]} "
-        "[--hidden-zenkaku-space] [--35] [--console] [--nerd-font]"
+        "[--hidden-zenkaku-space | --with-hidden-zenkaku-space] "
+        "[--35] [--console] [--nerd-font] "
+        "[--style <STYLE>] [--jobs <N>] [--no-cache] [--serve <ADDRESS>] "
+        "[--subset <RANGES | FILE>] [--trace <FILE>] [--verify-batched-transform] "
+        "[--verify-incremental] [--publish]"
     )
 
 
-def get_options():
-    """オプションを取得する"""
+def get_options(argv=None):
+    """オプションを取得する。argv を省略した場合はコマンドライン引数から取得する"""
 
     global options
 
+    if argv is None:
+        argv = sys.argv[1:]
+
     # オプションなしの場合は何もしない
-    if len(sys.argv) == 1:
+    if len(argv) == 0:
         return
 
-    for arg in sys.argv[1:]:
+    args = iter(argv)
+    for arg in args:
         # オプション判定
         if arg == "--do-not-delete-build-dir":
             options["do-not-delete-build-dir"] = True
         elif arg == "--hidden-zenkaku-space":
             options["hidden-zenkaku-space"] = True
+        elif arg == "--with-hidden-zenkaku-space":
+            options["with-hidden-zenkaku-space"] = True
         elif arg == "--35":
             options["35"] = True
         elif arg == "--console":
@@ -126,11 +501,81 @@ def get_options():
             options["nerd-font"] = True
         elif arg == "--debug":
             options["debug"] = True
+        elif arg == "--style":
+            style = next(args, None)
+            if style not in STYLES:
+                options["unknown-option"] = True
+                return
+            options["style"] = style
+        elif arg == "--no-cache":
+            options["no-cache"] = True
+        elif arg == "--jobs":
+            jobs = next(args, "")
+            if not jobs.isdecimal() or int(jobs) < 1:
+                options["unknown-option"] = True
+                return
+            options["jobs"] = int(jobs)
+        elif arg == "--serve":
+            address = next(args, None)
+            if address is None:
+                options["unknown-option"] = True
+                return
+            options["serve"] = address
+        elif arg == "--subset":
+            codepoints = parse_subset(next(args, ""))
+            if not codepoints:
+                options["unknown-option"] = True
+                return
+            # キャッシュキーに含まれるよう、ファイル指定の場合もコードポイントの一覧で保持する
+            options["subset"] = tuple(sorted(codepoints))
+        elif arg == "--trace":
+            trace_path = next(args, None)
+            if trace_path is None:
+                options["unknown-option"] = True
+                return
+            options["trace"] = trace_path
+        elif arg == "--verify-batched-transform":
+            options["verify-batched-transform"] = True
+        elif arg == "--verify-incremental":
+            options["verify-incremental"] = True
+        elif arg == "--publish":
+            options["publish"] = True
         else:
             options["unknown-option"] = True
             return
 
+    # 全角スペース不可視版のみの生成と、可視版・不可視版の同時生成は両立しない
+    if options.get("hidden-zenkaku-space") and options.get("with-hidden-zenkaku-space"):
+        options["unknown-option"] = True
+
+
+def parse_subset(value):
+    """--subset の値からコードポイントの集合を求める。
+    値はサンプルテキストのファイルか、`U+3040-309F,U+4E00` 形式の Unicode 範囲のリスト。
+    解釈できない場合は None を返す。"""
+    if os.path.isfile(value):
+        with open(value, encoding="utf-8") as f:
+            return {ord(char) for char in f.read()}
+
+    codepoints = set()
+    for item in value.split(","):
+        start, _, end = item.partition("-")
+        try:
+            start = parse_codepoint(start)
+            end = parse_codepoint(end) if end else start
+        except ValueError:
+            return None
+        codepoints.update(range(start, end + 1))
+    return codepoints
+
+
+def parse_codepoint(value):
+    """`U+3042`, `0x3042`, `3042` 形式のコードポイントを数値にする"""
+    value = value.strip().upper()
+    return int(value.removeprefix("U+").removeprefix("0X"), 16)
+
 
+@build_trace.traced
 def generate_font(jp_style, eng_style, merged_style, italic=False):
     print(f"=== Generate {merged_style} ===")
 
@@ -139,6 +584,9 @@ def generate_font(jp_style, eng_style, merged_style, italic=False):
 
     # ※従来はEMをここで揃えるが、Noto Sans Mono と Noto Sans JP は既にEMが揃っているため不要
 
+    # コードポイントごとに英語フォント・日本語フォント・Nerd Fonts のどれを採用するかを決める
+    ownership = make_ownership_map(jp_font, eng_font)
+
     if options.get("console"):
         # コンソール用フォントの場合はできるだけEAAW文字を半角幅にする
         # TODO ここの処理の要否はあとで検討
@@ -146,10 +594,10 @@ def generate_font(jp_style, eng_style, merged_style, italic=False):
         pass
     else:
         # 全角化する記号類を英語フォントから削除する
-        delete_not_console_glyphs(jp_font, eng_font)
+        delete_not_console_glyphs(eng_font, ownership)
 
     # 重複するグリフを削除する
-    delete_duplicate_glyphs(jp_font, eng_font)
+    delete_duplicate_glyphs(jp_font, ownership)
 
     # いくつかのグリフ形状に調整を加える
     adjust_some_glyph(jp_font, eng_font)
@@ -161,19 +609,29 @@ def generate_font(jp_style, eng_style, merged_style, italic=False):
     # GPOSもおまけに削除
     remove_lookups(jp_font)
 
-    # 全角スペースを可視化する
-    if not options.get("hidden-zenkaku-space"):
-        visualize_zenkaku_space(jp_font)
-
     # Nerd Fontのグリフを追加する
+    # 全角スペースの可視化とは対象のグリフが重ならないため、可視化より先に追加しておき
+    # 可視版・不可視版で処理を共有する
     if options.get("nerd-font"):
-        add_nerd_font_glyphs(jp_font, eng_font)
+        add_nerd_font_glyphs(jp_font, eng_font, ownership)
+
+    # 全角スペースの可視化の有無だけが異なるフォントは、ここまでの処理を共有して続けて生成する
+    for hidden_zenkaku_space in zenkaku_space_variants():
+        # 全角スペースを可視化する
+        if not hidden_zenkaku_space:
+            visualize_zenkaku_space(jp_font)
 
+        generate_variant_font(jp_font, eng_font, merged_style, hidden_zenkaku_space)
+
+    # ttfを閉じる
+    jp_font.close()
+    eng_font.close()
+
+
+def generate_variant_font(jp_font, eng_font, merged_style, hidden_zenkaku_space):
+    """メタデータを設定してバリエーションごとのttfファイルに保存する"""
     # オプション毎の修飾子を追加する
-    variant = f"{CONSOLE_STR} " if options.get("console") else ""
-    variant += HIDDEN_ZENKAKU_SPACE_STR if options.get("hidden-zenkaku-space") else ""
-    variant += NERD_FONTS_STR if options.get("nerd-font") else ""
-    variant = variant.strip()
+    variant = variant_name(hidden_zenkaku_space)
 
     # macOSでのpostテーブルの使用性エラー対策
     # 重複するグリフ名を持つグリフをリネームする
@@ -196,114 +654,368 @@ def generate_font(jp_style, eng_style, merged_style, italic=False):
 
     # ttfファイルに保存
     # なんらかフラグを立てるとGSUB, GPOSテーブルが削除されて後続の生成処理で影響が出るため注意
-    w35_str = W35_WIDTH_STR if options.get("35") else ""
-    eng_font.generate(
-        f"{BUILD_FONTS_DIR}/{FONTFORGE_PREFIX}{FONT_NAME}{w35_str}{variant}-{merged_style}-eng.ttf".replace(
-            " ", ""
+    eng_font_path, jp_font_path = output_font_paths(merged_style, hidden_zenkaku_space)
+    with build_trace.stage("generate"):
+        eng_font.generate(eng_font_path)
+        generate_jp_font(jp_font, jp_font_path)
+    publish_fonts(eng_font_path, jp_font_path)
+
+
+def publish_fonts(eng_font_path, jp_font_path):
+    """--publish の場合、生成したフォントの組を fonttools_script.py --stream に知らせる行を出力する"""
+    if not options.get("publish"):
+        return
+    # 並列実行中の他プロセスの出力と混ざらないよう、1行ずつすぐに書き出す
+    print(f"{PUBLISH_MARKER}{eng_font_path}\t{jp_font_path}", flush=True)
+
+
+def generate_jp_font(jp_font, jp_font_path):
+    """日本語フォントを ttf に保存する。
+    前回の出力とグリフごとの指紋がキャッシュにあれば、指紋が変わったグリフだけを生成して
+    前回の出力に差し替える。グリフの追加・削除や幅・コードポイントの変更がある場合は全体を生成する。
+    指紋は調整処理の後に求めるため、調整処理は毎回全グリフに適用され、省略されるのは ttf の出力のみ。"""
+    if options.get("no-cache"):
+        jp_font.generate(jp_font_path)
+        return
+
+    manifest = make_glyph_manifest(jp_font)
+    key = build_cache.make_key(
+        GLYPH_MANIFEST_VERSION,
+        os.path.basename(jp_font_path),
+        sorted(
+            (key, value)
+            for key, value in options.items()
+            if key not in NON_OUTPUT_OPTIONS
         ),
+        fontforge.version(),
     )
-    jp_font.generate(
-        f"{BUILD_FONTS_DIR}/{FONTFORGE_PREFIX}{FONT_NAME}{w35_str}{variant}-{merged_style}-jp.ttf".replace(
-            " ", ""
-        ),
+    previous_font_path = f"{jp_font_path}.previous"
+    manifest_path = f"{jp_font_path}.manifest.json"
+    changed_glyph_names = None
+    if build_cache.fetch(
+        "glyph-manifest",
+        key,
+        {"jp.ttf": previous_font_path, "manifest.json": manifest_path},
+    ):
+        with open(manifest_path, encoding="utf-8") as f:
+            changed_glyph_names = find_changed_glyphs(json.load(f), manifest)
+
+    if changed_glyph_names == []:
+        print("incremental generate: no glyphs changed")
+        shutil.move(previous_font_path, jp_font_path)
+        os.remove(manifest_path)
+        if options.get("verify-incremental"):
+            verify_incremental_font(jp_font, jp_font_path)
+        return
+
+    if changed_glyph_names is not None and splice_changed_glyphs(
+        jp_font, changed_glyph_names, previous_font_path, jp_font_path
+    ):
+        print(f"incremental generate: {len(changed_glyph_names)} glyphs changed")
+        if options.get("verify-incremental"):
+            verify_incremental_font(jp_font, jp_font_path)
+    else:
+        jp_font.generate(jp_font_path)
+    if os.path.exists(previous_font_path):
+        os.remove(previous_font_path)
+
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    build_cache.store(
+        "glyph-manifest",
+        key,
+        {"jp.ttf": jp_font_path, "manifest.json": manifest_path},
+        replace=True,
     )
+    os.remove(manifest_path)
 
-    # ttfを閉じる
-    jp_font.close()
-    eng_font.close()
+
+@build_trace.traced
+def make_glyph_manifest(font):
+    """フォント全体の指紋と、グリフごとの指紋を作成する。
+    グリフの指紋は、ソースの輪郭に各調整処理を適用した結果の輪郭と、幅・コードポイントの2つに分ける。"""
+    glyph_names = []
+    glyphs = {}
+    for glyph in font.glyphs():
+        glyph_names.append(glyph.glyphname)
+        outline = build_cache.make_key(
+            [
+                [(point.x, point.y, point.on_curve) for point in contour]
+                for contour in glyph.foreground
+            ],
+            glyph.references,
+            # 命令だけが変わった場合も差し替える
+            glyph.ttinstrs,
+        )
+        layout = build_cache.make_key(
+            glyph.unicode,
+            glyph.altuni,
+            glyph.width,
+            glyph.vwidth,
+            glyph.isWorthOutputting(),
+        )
+        glyphs[glyph.glyphname] = [outline[:16], layout[:16]]
+
+    # メタデータなどグリフ以外のテーブルの内容は前回の出力をそのまま使うため、フォント全体の指紋で確認する
+    # GSUB, GPOS はルックアップの内容までを別の指紋で確認する
+    font_attributes = sorted(
+        name for name in dir(font) if name.startswith(("os2_", "hhea_"))
+    )
+    font_key = build_cache.make_key(
+        [getattr(font, name) for name in font_attributes],
+        font.sfnt_names,
+        font.fontname,
+        font.familyname,
+        font.fullname,
+        font.weight,
+        font.version,
+        font.copyright,
+        font.em,
+        font.ascent,
+        font.descent,
+        font.italicangle,
+        font.upos,
+        font.uwidth,
+        font.hasvmetrics,
+        glyph_names,
+    )
+    return {
+        "version": GLYPH_MANIFEST_VERSION,
+        "font": font_key,
+        "layout": make_layout_key(font),
+        "glyphs": glyphs,
+    }
+
+
+def make_layout_key(font):
+    """GSUB, GPOS, GDEF に出力される内容の指紋を作成する。
+    ルックアップ名だけでなく、サブテーブル・クラスカーニング・グリフごとの置換と位置調整の内容を含める。
+    内容を確認できないルックアップがある場合は None を返す。"""
+    lookups = list(font.gsub_lookups) + list(font.gpos_lookups)
+    lookup_data = []
+    for lookup in lookups:
+        lookup_info = font.getLookupInfo(lookup)
+        if lookup_info[0] in UNVERIFIABLE_LOOKUP_TYPES:
+            return None
+        subtables = []
+        for subtable in font.getLookupSubtables(lookup):
+            kerning_class = None
+            if font.isKerningClass(subtable):
+                kerning_class = font.getKerningClass(subtable)
+            subtables.append((subtable, kerning_class))
+        lookup_data.append((lookup, lookup_info, subtables))
+
+    glyph_data = []
+    for glyph in font.glyphs():
+        if lookups:
+            glyph_data.append(
+                (
+                    glyph.glyphname,
+                    glyph.glyphclass,
+                    glyph.getPosSub("*"),
+                    glyph.anchorPoints,
+                )
+            )
+        else:
+            # ルックアップがない場合は GDEF のグリフクラスのみ確認する
+            glyph_data.append((glyph.glyphname, glyph.glyphclass))
+    return build_cache.make_key(lookup_data, glyph_data)
+
+
+def find_changed_glyphs(previous_manifest, manifest):
+    """輪郭の指紋が変わったグリフ名の一覧を返す。差し替えで対応できない場合は None"""
+    if previous_manifest.get("version") != GLYPH_MANIFEST_VERSION:
+        return None
+    if previous_manifest["font"] != manifest["font"]:
+        return None
+    # ソースフォントの更新や調整処理の変更で GSUB, GPOS の内容が変わった場合と、
+    # 内容を確認できない場合は、前回の出力のテーブルを使えない
+    if manifest["layout"] is None or previous_manifest["layout"] != manifest["layout"]:
+        return None
+    previous_glyphs = previous_manifest["glyphs"]
+    if previous_glyphs.keys() != manifest["glyphs"].keys():
+        return None
+    changed_glyph_names = []
+    for glyph_name, (outline, layout) in manifest["glyphs"].items():
+        previous_outline, previous_layout = previous_glyphs[glyph_name]
+        if previous_layout != layout:
+            return None
+        if previous_outline != outline:
+            changed_glyph_names.append(glyph_name)
+    if (
+        len(changed_glyph_names)
+        > len(manifest["glyphs"]) * INCREMENTAL_MAX_CHANGED_RATIO
+    ):
+        return None
+    return changed_glyph_names
+
+
+@build_trace.traced
+def splice_changed_glyphs(
+    jp_font, changed_glyph_names, previous_font_path, output_path
+):
+    """変更されたグリフだけの ttf を生成し、前回の出力のグリフと差し替えて保存する。
+    差し替えできなかった場合は False を返す。"""
+    try:
+        # FontForge 同梱の Python に fontTools がない場合は全体を生成する
+        from fontTools import ttLib
+    except ImportError:
+        return False
+
+    # 変更されたグリフだけのフォントを作成して生成する
+    partial_font_path = f"{output_path}.partial.ttf"
+    partial_font = fontforge.font()
+    # 全体を生成した場合と同じ輪郭になるよう、生成に影響する設定を合わせる
+    # (新しいフォントは3次曲線のため、2次曲線のグリフを貼り付けると変換されてしまう)
+    partial_font.is_quadratic = jp_font.is_quadratic
+    partial_font.em = jp_font.em
+    partial_font.ascent = jp_font.ascent
+    partial_font.descent = jp_font.descent
+    partial_font.hasvmetrics = jp_font.hasvmetrics
+    for glyph_name in changed_glyph_names:
+        partial_font.createChar(-1, glyph_name)
+        jp_font.selection.select(glyph_name)
+        jp_font.copy()
+        partial_font.selection.select(glyph_name)
+        partial_font.paste()
+    jp_font.selection.none()
+    partial_font.generate(partial_font_path)
+    partial_font.close()
+
+    font = ttLib.TTFont(previous_font_path)
+    partial = ttLib.TTFont(partial_font_path)
+    glyf_table = font["glyf"]
+    partial_glyf_table = partial["glyf"]
+    for glyph_name in changed_glyph_names:
+        if glyph_name not in partial_glyf_table or glyph_name not in glyf_table:
+            # 出力時にグリフ名が変わった場合など
+            os.remove(partial_font_path)
+            return False
+        glyph = partial_glyf_table[glyph_name]
+        if glyph.isComposite() and any(
+            component.glyphName not in glyf_table for component in glyph.components
+        ):
+            os.remove(partial_font_path)
+            return False
+        previous_glyph = glyf_table[glyph_name]
+        if "vmtx" in font:
+            # 縦書きの上端からの距離を輪郭の上端の移動に合わせる
+            advance_height, top_side_bearing = font["vmtx"][glyph_name]
+            font["vmtx"][glyph_name] = (
+                advance_height,
+                top_side_bearing
+                + getattr(previous_glyph, "yMax", 0)
+                - getattr(glyph, "yMax", 0),
+            )
+        glyf_table[glyph_name] = glyph
+        font["hmtx"][glyph_name] = partial["hmtx"][glyph_name]
+    font.save(output_path)
+    font.close()
+    partial.close()
+    os.remove(partial_font_path)
+    return True
+
+
+@build_trace.traced
+def verify_incremental_font(jp_font, jp_font_path):
+    """差し替えて保存した日本語フォントが、全体を生成した場合とグリフ単位で一致することを確認する"""
+    from fontTools import ttLib
+
+    full_font_path = f"{jp_font_path}.full.ttf"
+    jp_font.generate(full_font_path)
+    font = ttLib.TTFont(jp_font_path)
+    full_font = ttLib.TTFont(full_font_path)
+    if font.getGlyphOrder() != full_font.getGlyphOrder():
+        raise RuntimeError(
+            "incremental generate differs from full generate: glyph order"
+        )
+
+    mismatched = []
+    glyf_table = font["glyf"]
+    full_glyf_table = full_font["glyf"]
+    has_vmtx = "vmtx" in full_font
+    for glyph_name in full_font.getGlyphOrder():
+        data = glyf_table[glyph_name].compile(glyf_table)
+        full_data = full_glyf_table[glyph_name].compile(full_glyf_table)
+        same = data == full_data
+        for tag in ["hmtx", "vmtx"] if has_vmtx else ["hmtx"]:
+            same = same and font[tag][glyph_name] == full_font[tag][glyph_name]
+        if not same:
+            mismatched.append(glyph_name)
+    font.close()
+    full_font.close()
+    os.remove(full_font_path)
+    if mismatched:
+        raise RuntimeError(
+            f"incremental generate differs from full generate: "
+            f"{', '.join(mismatched[:20])}"
+        )
 
 
+@build_trace.traced
 def open_fonts(jp_style: str, eng_style: str):
     """フォントを開く"""
-    jp_font = fontforge.open(f"{SOURCE_FONTS_DIR}/{JP_FONT}{jp_style}.ttf")
-    if options.get("35"):
-        eng_font = fontforge.open(f"{SOURCE_FONTS_DIR}/{ENG_FONT_35}{eng_style}.ttf")
-    else:
-        eng_font = fontforge.open(f"{SOURCE_FONTS_DIR}/{ENG_FONT}{eng_style}.ttf")
+    jp_font_path, eng_font_path = source_font_paths(jp_style, eng_style)
+    return open_source_font(jp_font_path), open_source_font(eng_font_path)
 
-    # フォント参照を解除する
-    for glyph in jp_font.glyphs():
-        if glyph.isWorthOutputting():
-            jp_font.selection.select(("more", None), glyph)
-    jp_font.unlinkReferences()
-    for glyph in eng_font.glyphs():
-        if glyph.isWorthOutputting():
-            eng_font.selection.select(("more", None), glyph)
-    eng_font.unlinkReferences()
 
-    return jp_font, eng_font
+def open_source_font(path):
+    """ソースフォントを開く。
+    常駐モードで読み込み済みの場合は、fork 時に複製されたそのフォントを使う。"""
+    if path not in source_fonts:
+        return load_source_font(path)
+    font = source_fonts.pop(path)
+    if options.get("subset"):
+        prune_glyphs(font)
+    return font
 
 
-def add_nerd_font_glyphs(jp_font, eng_font):
+def prune_glyphs(font):
+    """--subset で指定したコードポイントと、各処理が参照するコードポイント以外のグリフを削除する"""
+    codepoints = set(options["subset"]) | set(SUBSET_REQUIRED_CODEPOINTS)
+    keep_glyph_names = {".notdef"}
+    for glyph in font.glyphs():
+        if glyph.unicode in codepoints or any(
+            altuni[0] in codepoints for altuni in glyph.altuni or ()
+        ):
+            keep_glyph_names.add(glyph.glyphname)
+    # 残すグリフから参照されているグリフも残す
+    pending = list(keep_glyph_names)
+    while pending:
+        glyph_name = pending.pop()
+        if glyph_name not in font:
+            continue
+        for reference in font[glyph_name].references:
+            if reference[0] not in keep_glyph_names:
+                keep_glyph_names.add(reference[0])
+                pending.append(reference[0])
+
+    for glyph in list(font.glyphs()):
+        if glyph.glyphname not in keep_glyph_names:
+            font.removeGlyph(glyph)
+
+
+def load_source_font(path):
+    """ソースフォントを開き、フォント参照を解除する"""
+    font = fontforge.open(path)
+    if options.get("subset"):
+        # 参照を解除する前に不要なグリフを削除しておく
+        prune_glyphs(font)
+    for glyph in font.glyphs():
+        if glyph.isWorthOutputting():
+            font.selection.select(("more", None), glyph)
+    font.unlinkReferences()
+    return font
+
+
+@build_trace.traced
+def add_nerd_font_glyphs(jp_font, eng_font, ownership):
     """Nerd Fontのグリフを追加する"""
-    global nerd_font
-    # Nerd Fontのグリフを追加する
-    if nerd_font is None:
-        nerd_font = fontforge.open(
-            f"{SOURCE_FONTS_DIR}/nerd-fonts/SymbolsNerdFont-Regular.ttf"
-        )
-        nerd_font.em = EM_ASCENT + EM_DESCENT
-        glyph_names = set()
-        for nerd_glyph in nerd_font.glyphs():
-            # Nerd Fontsのグリフ名をユニークにするため接尾辞を付ける
-            nerd_glyph.glyphname = f"{nerd_glyph.glyphname}-nf"
-            # postテーブルでのグリフ名重複対策
-            # fonttools merge で合成した後、MacOSで `'post'テーブルの使用性` エラーが発生することへの対処
-            if nerd_glyph.glyphname in glyph_names:
-                nerd_glyph.glyphname = f"{nerd_glyph.glyphname}-{nerd_glyph.encoding}"
-            glyph_names.add(nerd_glyph.glyphname)
-            # 幅を調整する
-            half_width = eng_font[0x0030].width
-            # Powerline Symbols の調整
-            if 0xE0B0 <= nerd_glyph.unicode <= 0xE0D4:
-                # なぜかズレている右付きグリフの個別調整 (EM 1000 に変更した後を想定して調整)
-                original_width = nerd_glyph.width
-                if nerd_glyph.unicode == 0xE0B2:
-                    nerd_glyph.transform(psMat.translate(-353, 0))
-                elif nerd_glyph.unicode == 0xE0B6:
-                    nerd_glyph.transform(psMat.translate(-414, 0))
-                elif nerd_glyph.unicode == 0xE0C5:
-                    nerd_glyph.transform(psMat.translate(-137, 0))
-                elif nerd_glyph.unicode == 0xE0C7:
-                    nerd_glyph.transform(psMat.translate(-214, 0))
-                elif nerd_glyph.unicode == 0xE0D4:
-                    nerd_glyph.transform(psMat.translate(-314, 0))
-                nerd_glyph.width = original_width
-                # 位置と幅合わせ
-                if nerd_glyph.width < half_width:
-                    nerd_glyph.transform(
-                        psMat.translate((half_width - nerd_glyph.width) / 2, 0)
-                    )
-                elif nerd_glyph.width > half_width:
-                    nerd_glyph.transform(psMat.scale(half_width / nerd_glyph.width, 1))
-                # グリフの高さ・位置を調整する
-                nerd_glyph.transform(psMat.scale(1, 1.14))
-                nerd_glyph.transform(psMat.translate(0, 21))
-            elif nerd_glyph.width < (EM_ASCENT + EM_DESCENT) * 0.6:
-                # 幅が狭いグリフは中央寄せとみなして調整する
-                nerd_glyph.transform(
-                    psMat.translate((half_width - nerd_glyph.width) / 2, 0)
-                )
-            # 幅を設定
-            nerd_glyph.width = half_width
+    nerd_font = load_nerd_font(eng_font[0x0030].width)
+
     # 日本語フォントにマージするため、既に存在する場合は削除する
-    for nerd_glyph in nerd_font.glyphs():
-        if nerd_glyph.unicode != -1:
-            # 既に存在する場合は削除する
-            try:
-                for glyph in jp_font.selection.select(
-                    ("unicode", None), nerd_glyph.unicode
-                ).byGlyphs:
-                    glyph.clear()
-            except Exception:
-                pass
-            try:
-                for glyph in eng_font.selection.select(
-                    ("unicode", None), nerd_glyph.unicode
-                ).byGlyphs:
-                    glyph.clear()
-            except Exception:
-                pass
+    clear_glyphs(jp_font, ownership["nerd_jp_clear"])
+    clear_glyphs(eng_font, ownership["nerd_eng_clear"])
 
     jp_font.mergeFonts(nerd_font)
 
@@ -311,6 +1023,87 @@ def add_nerd_font_glyphs(jp_font, eng_font):
     eng_font.selection.none()
 
 
+@build_trace.traced
+def load_nerd_font(half_width):
+    """半角幅に合わせて調整した Nerd Font を開く。
+    調整済みのグリフセットは半角幅ごとに SFD でキャッシュし、プロセス内でも使い回す。"""
+    if half_width in nerd_fonts:
+        return nerd_fonts[half_width]
+
+    source_path = f"{SOURCE_FONTS_DIR}/nerd-fonts/SymbolsNerdFont-Regular.ttf"
+    cache_key = None
+    if not options.get("no-cache"):
+        cache_key = build_cache.make_key(
+            build_cache.file_digest(source_path),
+            half_width,
+            EM_ASCENT + EM_DESCENT,
+            # 調整処理の変更と FontForge のバージョン違いでキャッシュを無効にする
+            build_cache.file_digest(__file__),
+            fontforge.version(),
+        )
+        sfd_path = f"{BUILD_FONTS_DIR}/nerd-{half_width}-{os.getpid()}.sfd"
+        if build_cache.fetch("nerd-font", cache_key, {"nerd.sfd": sfd_path}):
+            nerd_fonts[half_width] = fontforge.open(sfd_path)
+            os.remove(sfd_path)
+            return nerd_fonts[half_width]
+
+    nerd_font = fontforge.open(source_path)
+    normalize_nerd_font(nerd_font, half_width)
+
+    if cache_key is not None:
+        nerd_font.save(sfd_path)
+        build_cache.store("nerd-font", cache_key, {"nerd.sfd": sfd_path})
+        os.remove(sfd_path)
+    nerd_fonts[half_width] = nerd_font
+    return nerd_font
+
+
+def normalize_nerd_font(nerd_font, half_width):
+    """Nerd Font の EM・グリフ名・幅を合成先のフォントに合わせる"""
+    nerd_font.em = EM_ASCENT + EM_DESCENT
+    glyph_names = set()
+    for nerd_glyph in nerd_font.glyphs():
+        # Nerd Fontsのグリフ名をユニークにするため接尾辞を付ける
+        nerd_glyph.glyphname = f"{nerd_glyph.glyphname}-nf"
+        # postテーブルでのグリフ名重複対策
+        # fonttools merge で合成した後、MacOSで `'post'テーブルの使用性` エラーが発生することへの対処
+        if nerd_glyph.glyphname in glyph_names:
+            nerd_glyph.glyphname = f"{nerd_glyph.glyphname}-{nerd_glyph.encoding}"
+        glyph_names.add(nerd_glyph.glyphname)
+        # Powerline Symbols の調整
+        if 0xE0B0 <= nerd_glyph.unicode <= 0xE0D4:
+            # なぜかズレている右付きグリフの個別調整 (EM 1000 に変更した後を想定して調整)
+            original_width = nerd_glyph.width
+            if nerd_glyph.unicode == 0xE0B2:
+                nerd_glyph.transform(psMat.translate(-353, 0))
+            elif nerd_glyph.unicode == 0xE0B6:
+                nerd_glyph.transform(psMat.translate(-414, 0))
+            elif nerd_glyph.unicode == 0xE0C5:
+                nerd_glyph.transform(psMat.translate(-137, 0))
+            elif nerd_glyph.unicode == 0xE0C7:
+                nerd_glyph.transform(psMat.translate(-214, 0))
+            elif nerd_glyph.unicode == 0xE0D4:
+                nerd_glyph.transform(psMat.translate(-314, 0))
+            nerd_glyph.width = original_width
+            # 位置と幅合わせ
+            if nerd_glyph.width < half_width:
+                nerd_glyph.transform(
+                    psMat.translate((half_width - nerd_glyph.width) / 2, 0)
+                )
+            elif nerd_glyph.width > half_width:
+                nerd_glyph.transform(psMat.scale(half_width / nerd_glyph.width, 1))
+            # グリフの高さ・位置を調整する
+            nerd_glyph.transform(psMat.scale(1, 1.14))
+            nerd_glyph.transform(psMat.translate(0, 21))
+        elif nerd_glyph.width < (EM_ASCENT + EM_DESCENT) * 0.6:
+            # 幅が狭いグリフは中央寄せとみなして調整する
+            nerd_glyph.transform(
+                psMat.translate((half_width - nerd_glyph.width) / 2, 0)
+            )
+        # 幅を設定
+        nerd_glyph.width = half_width
+
+
 def delete_glyphs_with_duplicate_glyph_names(font):
     """重複するグリフ名を持つグリフをリネームする"""
     glyph_name_set = set()
@@ -321,6 +1114,7 @@ def delete_glyphs_with_duplicate_glyph_names(font):
             glyph_name_set.add(glyph.glyphname)
 
 
+@build_trace.traced
 def adjust_some_glyph(jp_font, eng_font):
     """いくつかのグリフ形状に調整を加える"""
     # 全角括弧の開きを広くする
@@ -344,14 +1138,16 @@ def adjust_some_glyph(jp_font, eng_font):
             continue
 
     # 矢印記号の読みづらさ対策
-    for uni in [0x2190, 0x2192, 0x2194, 0x21D0, 0x21D2, 0x21D4, 0x21DA, 0x21DB]:
-        eng_font.selection.select(("unicode", None), uni)
-        for glyph in eng_font.selection.byGlyphs:
-            scale_glyph(glyph, 1, 1.3)
-    for uni in [0x2191, 0x2193, 0x2195, 0x21D1, 0x21D3]:
-        eng_font.selection.select(("unicode", None), uni)
-        for glyph in eng_font.selection.byGlyphs:
-            scale_glyph(glyph, 1.3, 1)
+    # 同じ倍率のグリフはまとめて変換する
+    eng_font.selection.select(
+        ("unicode", None),
+        *[0x2190, 0x2192, 0x2194, 0x21D0, 0x21D2, 0x21D4, 0x21DA, 0x21DB],
+    )
+    scale_glyphs(eng_font, list(eng_font.selection.byGlyphs), 1, 1.3)
+    eng_font.selection.select(
+        ("unicode", None), *[0x2191, 0x2193, 0x2195, 0x21D1, 0x21D3]
+    )
+    scale_glyphs(eng_font, list(eng_font.selection.byGlyphs), 1.3, 1)
     # for uni in range(0x21D6, 0x21D9 + 1):
     #     eng_font.selection.select(("unicode", None), uni)
     #     for glyph in eng_font.selection.byGlyphs:
@@ -383,38 +1179,15 @@ def em_1000(font):
     font.em = EM_ASCENT + EM_DESCENT
 
 
-def delete_duplicate_glyphs(jp_font, eng_font):
+@build_trace.traced
+def delete_duplicate_glyphs(jp_font, ownership):
     """jp_fontとeng_fontのグリフを比較し、重複するグリフを削除する"""
-
-    eng_font.selection.none()
-    jp_font.selection.none()
-
-    for glyph in jp_font.glyphs("encoding"):
-        try:
-            if glyph.isWorthOutputting() and glyph.unicode > 0:
-                eng_font.selection.select(("more", "unicode"), glyph.unicode)
-        except ValueError:
-            # Encoding is out of range のときは継続する
-            continue
-
     # 削除箇所に altuni が設定されている場合は削除する前にコピーする
-    for glyph in eng_font.selection.byGlyphs:
-        jp_font.selection.select(("more", "unicode"), glyph.unicode)
-    altuni_glyph_list = []
-    for glyph in jp_font.selection.byGlyphs:
-        if glyph.altuni:
-            altuni_glyph_list.append(glyph.unicode)
-    materialize_altuni_glyphs(jp_font, altuni_glyph_list)
+    materialize_altuni_glyphs(jp_font, ownership["jp_materialize"])
     jp_font.selection.none()
 
     # 重複するグリフを削除する
-    for glyph in eng_font.selection.byGlyphs:
-        jp_font.selection.select(("more", "unicode"), glyph.unicode)
-    for glyph in jp_font.selection.byGlyphs:
-        glyph.clear()
-
-    jp_font.selection.none()
-    eng_font.selection.none()
+    clear_glyphs(jp_font, ownership["jp_clear"])
 
 
 def materialize_altuni_glyphs(font, entity_glyph_unicode_list):
@@ -466,73 +1239,161 @@ def materialize_altuni_glyphs(font, entity_glyph_unicode_list):
             font.paste()
 
 
+@build_trace.traced
 def remove_lookups(font):
     """GSUB, GPOSテーブルを削除する"""
     for lookup in list(font.gsub_lookups) + list(font.gpos_lookups):
         font.removeLookup(lookup)
 
 
-def delete_not_console_glyphs(jp_font, eng_font):
+@build_trace.traced
+def delete_not_console_glyphs(eng_font, ownership):
     """日本語フォントを優先するために不要なグリフを削除する"""
-    jp_font.selection.none()
-    eng_font.selection.none()
+    clear_glyphs(eng_font, ownership["eng_clear"])
 
-    # delete_eng_glyph_when_jp_font_has_glyph() はメソッド内で選択範囲を変更するため、他の処理と分けて最初に実行する
-    delete_eng_glyph_when_jp_font_has_glyph(jp_font, eng_font, 0x2190, 0x21FF)  # Arrows
-    delete_eng_glyph_when_jp_font_has_glyph(
-        jp_font, eng_font, 0x2200, 0x22FF
-    )  # Mathematical Operators
-    delete_eng_glyph_when_jp_font_has_glyph(
-        jp_font, eng_font, 0x2000, 0x206F
-    )  # General Punctuation
-    delete_eng_glyph_when_jp_font_has_glyph(
-        jp_font, eng_font, 0x2100, 0x214F
-    )  # Letterlike Symbols
-
-    # 記号
-    eng_font.selection.select(("more", "unicode"), 0x00D7)  # ×
-    eng_font.selection.select(("more", "unicode"), 0x00F7)  # ÷
-    # ─-╿ (Box Drawing) (U+2500-U+257F)
-    eng_font.selection.select(("more", "ranges"), 0x2500, 0x257F)
-
-    # 英語フォントを優先して適用するために削除範囲から除外する
-    # 各エディタの可視化文字対策
-    eng_font.selection.select(("less", "unicode"), 0x2022)
-    eng_font.selection.select(("less", "unicode"), 0x00B7)
-    eng_font.selection.select(("less", "unicode"), 0x2024)
-    eng_font.selection.select(("less", "unicode"), 0x2219)
-    eng_font.selection.select(("less", "unicode"), 0x25D8)
-    eng_font.selection.select(("less", "unicode"), 0x25E6)
-    # 結合文音記号は英語フォントを適用
-    eng_font.selection.select(("less", "unicode", "ranges"), 0x0300, 0x0328)
-    # « »
-    eng_font.selection.select(("less", "unicode"), 0xAB)
-    eng_font.selection.select(("less", "unicode"), 0xBB)
-    # broken bar
-    eng_font.selection.select(("less", "unicode"), 0x00A6)
 
-    for glyph in eng_font.selection.byGlyphs:
-        glyph.clear()
+def clear_glyphs(font, codepoints):
+    """コードポイントに割り当てられたグリフをまとめて削除する"""
+    font.selection.none()
+    if codepoints:
+        font.selection.select(("unicode", None), *codepoints)
+        for glyph in font.selection.byGlyphs:
+            glyph.clear()
+    font.selection.none()
 
-    jp_font.selection.none()
-    eng_font.selection.none()
 
+def build_codepoint_index(font):
+    """フォントを1回走査して、コードポイントからグリフを引く索引を作る。
+    値は (グリフ名, 実体のコードポイント, 出力対象か, altuni を持つか) で、
+    altuni で割り当てられたコードポイントも実体のグリフを指す。"""
+    index = {}
+    altuni_codepoints = []
+    for glyph in font.glyphs():
+        if glyph.unicode < 0:
+            continue
+        entry = (
+            glyph.glyphname,
+            glyph.unicode,
+            glyph.isWorthOutputting(),
+            bool(glyph.altuni),
+        )
+        index[glyph.unicode] = entry
+        for altuni in glyph.altuni or ():
+            # variation-selector が -1 以外の場合は異体字セレクタなのでスキップ
+            if altuni[1] == -1:
+                altuni_codepoints.append((altuni[0], entry))
+    # 同じコードポイントを実体として持つグリフがある場合はそちらを優先する
+    for codepoint, entry in altuni_codepoints:
+        index.setdefault(codepoint, entry)
+    return index
+
+
+@build_trace.traced
+def make_ownership_map(jp_font, eng_font):
+    """コードポイント所有マップを作成する。
+    同じ索引から作られるマップは build ディレクトリに保存し、他のウェイトやプロセスで再利用する。"""
+    jp_index = build_codepoint_index(jp_font)
+    eng_index = build_codepoint_index(eng_font)
+    nerd_codepoints = []
+    if options.get("nerd-font"):
+        nerd_codepoints = sorted(
+            {
+                glyph.unicode
+                for glyph in load_nerd_font(eng_font[0x0030].width).glyphs()
+                if glyph.unicode != -1
+            }
+        )
 
-def delete_eng_glyph_when_jp_font_has_glyph(jp_font, eng_font, start, end):
-    """日本語フォントにグリフが存在する場合、英語フォントのグリフを削除する"""
-    for uni in range(start, end + 1):
-        try:
-            jp_font.selection.select(("unicode", None), uni)
-            eng_font.selection.select(("unicode", None), uni)
-            for glyph in jp_font.selection.byGlyphs:
-                if glyph.isWorthOutputting():
-                    for glyph in eng_font.selection.byGlyphs:
-                        glyph.clear()
-        except Exception:
-            # グリフが存在しない場合は継続する
+    key = build_cache.make_key(
+        OWNERSHIP_MAP_VERSION,
+        # 判定処理を変更したら別のマップを作成する
+        build_cache.file_digest(__file__),
+        sorted(jp_index.items()),
+        sorted(eng_index.items()),
+        bool(options.get("console")),
+        nerd_codepoints,
+    )
+    ownership_path = f"{BUILD_FONTS_DIR}/ownership/{key}.json"
+    if os.path.exists(ownership_path):
+        with open(ownership_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    ownership = decide_ownership(jp_index, eng_index, nerd_codepoints)
+    # 並列実行中の他プロセスが読みかけのファイルを参照しないよう、書き終えてからリネームする
+    os.makedirs(os.path.dirname(ownership_path), exist_ok=True)
+    tmp_path = f"{ownership_path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(ownership, f, indent=1)
+    os.replace(tmp_path, ownership_path)
+    print(f"ownership map: {ownership_path}")
+    return ownership
+
+
+def decide_ownership(jp_index, eng_index, nerd_codepoints):
+    """コードポイントごとに採用するフォントを決め、各フォントから削除するコードポイントをまとめる"""
+    # 全角化する記号類を英語フォントから削除する
+    eng_clear = []
+    if not options.get("console"):
+        for start, end in NOT_CONSOLE_JP_PRIORITY_RANGES:
+            for codepoint in range(start, end + 1):
+                jp_entry = jp_index.get(codepoint)
+                if jp_entry and jp_entry[2] and codepoint in eng_index:
+                    eng_clear.append(codepoint)
+        for codepoint in NOT_CONSOLE_DELETE_CODEPOINTS:
+            if codepoint in eng_index and codepoint not in NOT_CONSOLE_KEEP_CODEPOINTS:
+                eng_clear.append(codepoint)
+    # 削除はグリフ単位のため、altuni で割り当てられた他のコードポイントも削除される
+    cleared_eng_glyphs = {eng_index[codepoint][0] for codepoint in eng_clear}
+
+    # 日本語フォントにもある英語フォントのグリフは英語フォントを優先する
+    # 削除する日本語フォント側のコードポイントは、英語フォントのグリフの実体のコードポイントとする
+    jp_clear = set()
+    for glyphname, unicode, worth, _ in set(jp_index.values()):
+        if not worth or unicode <= 0:
             continue
-    jp_font.selection.none()
-    eng_font.selection.none()
+        eng_entry = eng_index.get(unicode)
+        if eng_entry and eng_entry[2] and eng_entry[0] not in cleared_eng_glyphs:
+            jp_clear.add(eng_entry[1])
+    jp_clear = sorted(codepoint for codepoint in jp_clear if codepoint in jp_index)
+    # 削除箇所に altuni が設定されている場合は、削除する前に実体を参照元へコピーする
+    jp_materialize = []
+    for codepoint in jp_clear:
+        _, unicode, worth, has_altuni = jp_index[codepoint]
+        if worth and has_altuni and unicode not in jp_materialize:
+            jp_materialize.append(unicode)
+
+    # Nerd Fonts のグリフは両方のフォントから削除してから追加する
+    nerd_jp_clear = [
+        codepoint for codepoint in nerd_codepoints if codepoint in jp_index
+    ]
+    nerd_eng_clear = [
+        codepoint for codepoint in nerd_codepoints if codepoint in eng_index
+    ]
+
+    # 確認用に、最終的にどのフォントのグリフが採用されるかを記録する
+    # 両方に残るコードポイントは fonttools merge で先に渡す英語フォントが採用される
+    nerd_set = set(nerd_codepoints)
+    jp_clear_set = set(jp_clear)
+    owner = {}
+    for codepoint in sorted(set(jp_index) | set(eng_index) | nerd_set):
+        eng_entry = eng_index.get(codepoint)
+        jp_entry = jp_index.get(codepoint)
+        if codepoint in nerd_set:
+            owner[f"{codepoint:04X}"] = "nerd"
+        elif eng_entry and eng_entry[2] and eng_entry[0] not in cleared_eng_glyphs:
+            owner[f"{codepoint:04X}"] = "eng"
+        elif jp_entry and jp_entry[2] and codepoint not in jp_clear_set:
+            owner[f"{codepoint:04X}"] = "jp"
+
+    return {
+        "version": OWNERSHIP_MAP_VERSION,
+        "eng_clear": eng_clear,
+        "jp_materialize": jp_materialize,
+        "jp_clear": jp_clear,
+        "nerd_jp_clear": nerd_jp_clear,
+        "nerd_eng_clear": nerd_eng_clear,
+        "owner": owner,
+    }
 
 
 def eaaw_width_to_half(jp_font):
@@ -576,18 +1437,83 @@ def eaaw_width_to_half(jp_font):
             scale_glyph(glyph, 0.67, 0.9)
 
 
+@build_trace.traced
 def to_monospace(jp_font):
-    """半角幅か全角幅になるように変換する"""
+    """半角幅か全角幅になるように変換する。
+    移動量は元の幅だけで決まるため、元の幅ごとにグリフをまとめて1回の変換で移動する。"""
+    base_width = 600 if options.get("35") else 500
+    buckets = {}
     for glyph in jp_font.glyphs():
         if 0 < glyph.width < 500 or (glyph.width == 500 and options.get("35")):
-            # グリフ位置を調整してから幅を設定
-            base_width = 600 if options.get("35") else 500
-            glyph.transform(psMat.translate((base_width - glyph.width) / 2, 0))
-            glyph.width = base_width
+            buckets.setdefault((glyph.width, base_width), []).append(glyph)
         elif 500 < glyph.width < 1000:
-            # グリフ位置を調整してから幅を設定
-            glyph.transform(psMat.translate((1000 - glyph.width) / 2, 0))
-            glyph.width = 1000
+            buckets.setdefault((glyph.width, 1000), []).append(glyph)
+
+    for (width, target_width), glyphs in buckets.items():
+        # グリフ位置を調整してから幅を設定
+        transform_glyphs(
+            jp_font, glyphs, psMat.translate((target_width - width) / 2, 0)
+        )
+        for glyph in glyphs:
+            glyph.width = target_width
+
+
+def transform_glyphs(font, glyphs, matrix):
+    """グリフをまとめて選択し、フォント単位の1回の変換で同じ変換を適用する。
+    --verify-batched-transform の場合は、グリフごとに変換した輪郭と一致することを確認する。"""
+    expected = None
+    if options.get("verify-batched-transform"):
+        expected = []
+        for glyph in glyphs:
+            layer = glyph.foreground
+            layer.transform(matrix)
+            expected.append(layer_points(layer))
+
+    font.selection.none()
+    font.selection.select(("more", None), *glyphs)
+    font.transform(matrix)
+    font.selection.none()
+
+    if expected is not None:
+        mismatched = [
+            glyph.glyphname
+            for glyph, points in zip(glyphs, expected)
+            if layer_points(glyph.foreground) != points
+        ]
+        if mismatched:
+            raise RuntimeError(
+                f"batched transform differs from per-glyph transform: "
+                f"{', '.join(mismatched[:20])}"
+            )
+
+
+def layer_points(layer):
+    """レイヤーの輪郭の点の座標を比較用に返す"""
+    return [
+        [(point.x, point.y, point.on_curve) for point in contour] for contour in layer
+    ]
+
+
+def scale_glyphs(font, glyphs, scale_x, scale_y):
+    """複数のグリフに scale_glyph と同じ調整を行う。
+    スケール変換はまとめて1回で行い、中心位置の補正はグリフごとに行う。"""
+    before = [(glyph, glyph.width, glyph.boundingBox()) for glyph in glyphs]
+    # スケール変換
+    transform_glyphs(font, glyphs, psMat.scale(scale_x, scale_y))
+    for glyph, original_width, before_bb in before:
+        before_center_x = (before_bb[0] + before_bb[2]) / 2
+        before_center_y = (before_bb[1] + before_bb[3]) / 2
+        after_bb = glyph.boundingBox()
+        after_center_x = (after_bb[0] + after_bb[2]) / 2
+        after_center_y = (after_bb[1] + after_bb[3]) / 2
+        # 拡大で増えた分を考慮して中心位置を調整
+        glyph.transform(
+            psMat.translate(
+                before_center_x - after_center_x,
+                before_center_y - after_center_y,
+            )
+        )
+        glyph.width = original_width
 
 
 def scale_glyph(glyph, scale_x, scale_y):
@@ -613,6 +1539,7 @@ def scale_glyph(glyph, scale_x, scale_y):
     glyph.width = original_width
 
 
+@build_trace.traced
 def visualize_zenkaku_space(jp_font):
     """全角スペースを可視化する"""
     # 全角スペースを差し替え
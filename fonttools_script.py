@@ -1,14 +1,34 @@
 #!/bin/env python3
 
 import configparser
+import copy
 import glob
 import os
+import struct
 import sys
-import xml.etree.ElementTree as ET
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from io import BytesIO
 from pathlib import Path
 
-from fontTools import merge, ttLib, ttx
-from ttfautohint import options, ttfautohint
+from fontTools import ttLib, varLib
+from fontTools.designspaceLib import (
+    AxisDescriptor,
+    DesignSpaceDocument,
+    InstanceDescriptor,
+    SourceDescriptor,
+)
+from fontTools.merge.tables import mergeOs2FsType
+from fontTools.misc.timeTools import timestampNow
+from fontTools.ttLib.tables._c_m_a_p import cmap_classes
+from fontTools.ttLib.tables.DefaultTable import DefaultTable
+from ttfautohint import __version__ as ttfautohint_version
+from ttfautohint import options as ttfautohint_options
+from ttfautohint import ttfautohint
+
+import build_cache
+import build_trace
 
 # iniファイルを読み込む
 settings = configparser.ConfigParser()
@@ -22,13 +42,167 @@ W35_WIDTH_STR = settings.get("DEFAULT", "W35_WIDTH_STR")
 HALF_WIDTH_12 = int(settings.get("DEFAULT", "HALF_WIDTH_12"))
 FULL_WIDTH_35 = int(settings.get("DEFAULT", "FULL_WIDTH_35"))
 
+# ttfautohint に渡す引数
+HINTING_ARGS = [
+    "-l",
+    "6",
+    "-r",
+    "45",
+    "-D",
+    "latn",
+    "-f",
+    "none",
+    "-S",
+    "-W",
+    "-X",
+    "14-",
+    "-x",
+    "0",
+    "-I",
+]
+# ヒンティング結果を左右するテーブル (ヒンティングキャッシュのキーに含める)
+# -W の指定で OS/2 の usWinAscent, usWinDescent からブルーゾーンが追加されるため OS/2 も含める
+HINTING_INPUT_TABLES = ["glyf", "loca", "hmtx", "maxp", "cmap", "OS/2", "head"]
+# キャッシュキーに含めない head テーブルの範囲 (checkSumAdjustment, created, modified)
+HEAD_VOLATILE_RANGES = [(8, 12), (20, 36)]
+# ttfautohint が書き換える・削除するテーブル
+HINTING_OUTPUT_TABLES = [
+    "glyf",
+    "loca",
+    "maxp",
+    "head",
+    "fpgm",
+    "prep",
+    "cvt ",
+    "gasp",
+    "hdmx",
+    "LTSH",
+    "VDMX",
+    "DSIG",
+]
+
+# 結合で削除するテーブル (グリフごとの値を持ち、日本語フォントのグリフ分がないもの)
+MERGE_DROP_TABLES = ["hdmx", "LTSH", "VDMX", "vhea", "vmtx", "DSIG"]
+# 結合時に大きい方・小さい方の値を採用する head テーブルの値
+HEAD_MAX_FIELDS = ["xMax", "yMax", "fontRevision", "lowestRecPPEM"]
+HEAD_MIN_FIELDS = ["xMin", "yMin"]
+# 両フォントで立っている場合のみ残す head テーブルの flags のビット (それ以外のビットは論理和)
+HEAD_FLAGS_AND_BITS = (
+    (1 << 1) | (1 << 2) | (1 << 3) | (1 << 5) | (1 << 11) | (1 << 13) | (1 << 14)
+)
+# 常に 0 にする head テーブルの flags のビット
+HEAD_FLAGS_ZERO_BITS = (1 << 6) | (1 << 15)
+# 結合時に大きい方・小さい方の値を採用する hhea テーブルの値
+HHEA_MAX_FIELDS = ["ascent", "lineGap", "advanceWidthMax", "xMaxExtent"]
+HHEA_MIN_FIELDS = ["descent", "minLeftSideBearing", "minRightSideBearing"]
+# 結合時に英語フォントの値を使う maxp テーブルの値 (ヒンティングは英語フォントのもののみ残る)
+MAXP_FIRST_FIELDS = [
+    "tableTag",
+    "tableVersion",
+    "numGlyphs",
+    "maxStorage",
+    "maxFunctionDefs",
+    "maxInstructionDefs",
+]
+# 結合時に論理和・大きい方・小さい方の値を採用する OS/2 テーブルの値
+OS2_OR_FIELDS = [
+    "ulUnicodeRange1",
+    "ulUnicodeRange2",
+    "ulUnicodeRange3",
+    "ulUnicodeRange4",
+    "ulCodePageRange1",
+    "ulCodePageRange2",
+]
+OS2_MAX_FIELDS = [
+    "version",
+    "usLastCharIndex",
+    "sTypoAscender",
+    "sTypoLineGap",
+    "usWinAscent",
+    "usWinDescent",
+    "sxHeight",
+    "sCapHeight",
+    "usMaxContext",
+]
+OS2_MIN_FIELDS = ["usFirstCharIndex", "sTypoDescender"]
+
+# fontforge_script.py --publish が生成したフォントの組を知らせる行の目印 (fontforge_script.py と同じ値)
+PUBLISH_MARKER = f"@@{FONT_NAME}-PUBLISH@@"
+
+# 可変フォントでは各マスターのヒンティングを共有できないため、ヒンティング関連のテーブルを削除する
+VARIABLE_FONT_DROP_TABLES = ["fpgm", "prep", "cvt ", "hdmx", "LTSH", "VDMX", "DSIG"]
+# 可変フォントのファイル名に付けるスタイル名
+VARIABLE_STYLE = "Variable"
+# 可変フォントで補間できなかったグリフの一覧の接尾辞 (build_script.py と同じ値)
+INCOMPATIBLE_REPORT_SUFFIX = "-incompatible.txt"
+# 可変フォントのデフォルトのマスターのウェイト
+DEFAULT_WEIGHT_CLASS = 400
+
+options = {}
+hinting_cache_stats = {"hit": 0, "miss": 0}
+
 
 def main():
-    # 第一引数を取得
-    # 特定のバリエーションのみを処理するための指定
-    specific_variant = sys.argv[1] if len(sys.argv) > 1 else None
+    # オプション判定
+    get_options()
+    if options.get("unknown-option"):
+        usage()
+        return
+
+    if options.get("trace"):
+        build_trace.enable(options["trace"])
+
+    if options.get("variable"):
+        build_variable_font(options.get("specific-variant", ""))
+        return
+
+    if options.get("stream"):
+        if not edit_published_fonts():
+            sys.exit(1)
+        return
+
+    edit_fonts(options.get("specific-variant"))
+
+
+def usage():
+    print(
+        f"Usage: {sys.argv[0]} [<VARIANT>] [--no-cache] [--variable] "
+        "[--stream [--jobs <N>]] [--trace <FILE>]"
+    )
+
 
-    edit_fonts(specific_variant)
+def get_options():
+    """オプションを取得する"""
+
+    global options
+
+    args = iter(sys.argv[1:])
+    for arg in args:
+        # オプション判定
+        if arg == "--no-cache":
+            options["no-cache"] = True
+        elif arg == "--variable":
+            options["variable"] = True
+        elif arg == "--stream":
+            options["stream"] = True
+        elif arg == "--jobs":
+            jobs = next(args, "")
+            if not jobs.isdecimal() or int(jobs) < 1:
+                options["unknown-option"] = True
+                return
+            options["jobs"] = int(jobs)
+        elif arg == "--trace":
+            trace_path = next(args, None)
+            if trace_path is None:
+                options["unknown-option"] = True
+                return
+            options["trace"] = trace_path
+        elif arg.startswith("--"):
+            options["unknown-option"] = True
+            return
+        else:
+            # 特定のバリエーションのみを処理するための指定
+            options["specific-variant"] = arg
 
 
 def edit_fonts(specific_variant: str):
@@ -49,9 +223,7 @@ def edit_fonts(specific_variant: str):
         print(f"edit {str(path)}")
         style = path.stem.split("-")[1]
         variant = path.stem.split("-")[0].replace(f"{FONTFORGE_PREFIX}{FONT_NAME}", "")
-        add_hinting(str(path), str(path).replace(".ttf", "-hinted.ttf"))
-        merge_fonts(style, variant)
-        fix_font_tables(style, variant)
+        edit_font(style, variant)
 
     # 一時ファイルを削除
     # スタイル部分以降はワイルドカードで指定
@@ -64,155 +236,464 @@ def edit_fonts(specific_variant: str):
     ):
         os.remove(filename)
 
+    if not options.get("no-cache"):
+        print(
+            "hinting cache: "
+            f"{hinting_cache_stats['hit']} hit, {hinting_cache_stats['miss']} miss"
+        )
+
+
+def edit_published_fonts() -> bool:
+    """標準入力から fontforge_script.py --publish の出力を読み、生成されたフォントの組から順に
+    ワーカープロセスで編集する。FontForge が次のウェイトを処理している間に編集を進められる。
+    英語フォントのヒンティング結果をキャッシュで共有できるよう、同じスタイルの組は順番に処理する。
+    全て成功した場合は True を返す。"""
+    # 完了済みの Future にコールバックを登録すると、登録したスレッドでそのまま呼ばれるため再入可能にする
+    lock = threading.RLock()
+    # スタイル → 処理待ちのバリエーションの一覧 (処理中のスタイルのみ)
+    waiting = {}
+    futures = []
+    failed = []
+    stats = {"hit": 0, "miss": 0}
+
+    executor = ProcessPoolExecutor(
+        max_workers=options.get("jobs", os.cpu_count() or 1),
+        initializer=init_worker,
+        initargs=(options,),
+    )
 
-def add_hinting(input_font_path, output_font_path):
-    """フォントにヒンティングを付ける"""
-    args = [
-        "-l",
-        "6",
-        "-r",
-        "45",
-        "-D",
-        "latn",
-        "-f",
-        "none",
-        "-S",
-        "-W",
-        "-X",
-        "14-",
-        "-x",
-        "0",
-        "-I",
-        input_font_path,
-        output_font_path,
-    ]
-    options_ = options.parse_args(args)
-    print("exec hinting", options_)
-    ttfautohint(**options_)
-
-
-def merge_fonts(style, variant):
-    """フォントを結合する"""
-    eng_font_path = f"{BUILD_FONTS_DIR}/{FONTFORGE_PREFIX}{FONT_NAME}{variant}-{style}-eng-hinted.ttf"
+    def submit(style, variant):
+        future = executor.submit(edit_published_font, style, variant)
+        future.add_done_callback(lambda future: on_done(future, style, variant))
+        futures.append(future)
+
+    def on_done(future, style, variant):
+        try:
+            worker_stats = future.result()
+        except Exception as e:
+            print(f"Error: {variant}-{style}: {e!r}", flush=True)
+            failed.append(f"{variant}-{style}")
+        else:
+            for key, value in worker_stats.items():
+                stats[key] += value
+            print(f"edited {FONT_NAME}{variant}-{style}", flush=True)
+        with lock:
+            if waiting[style]:
+                submit(style, waiting[style].pop(0))
+            else:
+                del waiting[style]
+
+    for line in sys.stdin:
+        if not line.startswith(PUBLISH_MARKER):
+            # FontForge 側のログはそのまま表示する
+            print(line, end="", flush=True)
+            continue
+        eng_font_path = Path(line.removeprefix(PUBLISH_MARKER).strip().split("\t")[0])
+        style = eng_font_path.stem.split("-")[1]
+        variant = eng_font_path.stem.split("-")[0].replace(
+            f"{FONTFORGE_PREFIX}{FONT_NAME}", ""
+        )
+        with lock:
+            if style in waiting:
+                waiting[style].append(variant)
+                continue
+            waiting[style] = []
+            submit(style, variant)
+
+    # 処理待ちの組は完了時のコールバックから投入されるため、全て投入されるまで待つ
+    while True:
+        with lock:
+            if not waiting:
+                break
+            pending = [future for future in futures if not future.done()]
+        if pending:
+            wait(pending)
+        else:
+            # 完了時のコールバックが次の組を投入するのを待つ
+            time.sleep(0.01)
+    executor.shutdown()
+
+    if not options.get("no-cache"):
+        print(f"hinting cache: {stats['hit']} hit, {stats['miss']} miss")
+    if len(futures) == 0:
+        print("Error: no fonts published")
+        return False
+    for name in failed:
+        print(f"Error: {FONT_NAME}{name} failed")
+    return len(failed) == 0
+
+
+def init_worker(worker_options):
+    """ワーカープロセスのグローバル変数を初期化する"""
+    global options
+    # spawn で起動した場合はオプションが未設定のため親プロセスから引き継ぐ
+    options = worker_options
+    if options.get("trace"):
+        build_trace.enable(options["trace"])
+
+
+def edit_published_font(style, variant) -> dict:
+    """公開されたフォントの組を編集し、中間ファイルを削除する。ヒンティングキャッシュの利用数を返す"""
+    hinting_cache_stats.update(hit=0, miss=0)
+    edit_font(style, variant)
+    for suffix in ["eng", "jp"]:
+        os.remove(
+            f"{BUILD_FONTS_DIR}/{FONTFORGE_PREFIX}{FONT_NAME}{variant}-{style}-{suffix}.ttf"
+        )
+    return dict(hinting_cache_stats)
+
+
+@build_trace.traced
+def edit_font(style, variant):
+    """ヒンティング・結合・テーブル編集を行う。
+    途中のフォントはメモリ上で受け渡し、完成したフォントのみをファイルに書き出す。"""
+    build_trace.set_tags(variant=variant, weight=style)
+    eng_font_path = (
+        f"{BUILD_FONTS_DIR}/{FONTFORGE_PREFIX}{FONT_NAME}{variant}-{style}-eng.ttf"
+    )
     jp_font_path = (
         f"{BUILD_FONTS_DIR}/{FONTFORGE_PREFIX}{FONT_NAME}{variant}-{style}-jp.ttf"
     )
-    # vhea, vmtxテーブルを削除
-    jp_font_object = ttLib.TTFont(jp_font_path)
-    if "vhea" in jp_font_object:
-        del jp_font_object["vhea"]
-    if "vmtx" in jp_font_object:
-        del jp_font_object["vmtx"]
-    jp_font_object.save(jp_font_path)
-    # フォントを結合
-    merger = merge.Merger()
-    merged_font = merger.merge([eng_font_path, jp_font_path])
-    merged_font.save(
-        f"{BUILD_FONTS_DIR}/{FONTTOOLS_PREFIX}{FONT_NAME}{variant}-{style}_merged.ttf"
-    )
 
+    hinted_eng_font = add_hinting(eng_font_path)
 
-def fix_font_tables(style, variant):
-    """フォントテーブルを編集する"""
+    with build_trace.stage("load_jp_font"):
+        jp_font = ttLib.TTFont(jp_font_path, lazy=True)
 
-    input_font_name = f"{FONTTOOLS_PREFIX}{FONT_NAME}{variant}-{style}_merged.ttf"
-    output_name_base = f"{FONTTOOLS_PREFIX}{FONT_NAME}{variant}-{style}"
-    completed_name_base = f"{FONT_NAME}{variant}-{style}"
+    merged_font = merge_fonts(hinted_eng_font, jp_font)
+    jp_font.close()
 
-    # OS/2, post テーブルのみのttxファイルを出力
-    xml = dump_ttx(input_font_name, output_name_base)
-    # OS/2 テーブルを編集
-    fix_os2_table(xml, style, flag_hw=W35_WIDTH_STR not in variant)
-    # post テーブルを編集
-    fix_post_table(xml, flag_hw=W35_WIDTH_STR not in variant)
-    # cmap テーブルを編集
-    fix_cmap_table(xml, style, variant)
-
-    # ttxファイルを上書き保存
-    xml.write(
-        f"{BUILD_FONTS_DIR}/{output_name_base}.ttx",
-        encoding="utf-8",
-        xml_declaration=True,
-    )
+    fix_font_tables(merged_font, style, variant)
 
-    # ttxファイルをttfファイルに適用
-    ttx.main(
-        [
-            "-o",
-            f"{BUILD_FONTS_DIR}/{output_name_base}_os2_post.ttf",
-            "-m",
-            f"{BUILD_FONTS_DIR}/{input_font_name}",
-            f"{BUILD_FONTS_DIR}/{output_name_base}.ttx",
-        ]
-    )
+    with build_trace.stage("save"):
+        merged_font.save(f"{BUILD_FONTS_DIR}/{FONT_NAME}{variant}-{style}.ttf")
+    merged_font.close()
 
-    # ファイル名を変更
-    os.rename(
-        f"{BUILD_FONTS_DIR}/{output_name_base}_os2_post.ttf",
-        f"{BUILD_FONTS_DIR}/{completed_name_base}.ttf",
-    )
 
+@build_trace.traced
+def add_hinting(input_font_path) -> bytes:
+    """フォントにヒンティングを付け、ヒンティング済みフォントのバイト列を返す。
+    アウトラインが同じフォントのヒンティング結果がキャッシュにあればそれを使う。"""
+    with open(input_font_path, "rb") as f:
+        input_font_data = f.read()
 
-def dump_ttx(input_name_base, output_name_base) -> ET:
-    """OS/2, post テーブルのみのttxファイルを出力"""
-    ttx.main(
-        [
-            "-t",
-            "OS/2",
-            "-t",
-            "post",
-            "-t",
-            "cmap",
-            "-f",
-            "-o",
-            f"{BUILD_FONTS_DIR}/{output_name_base}.ttx",
-            f"{BUILD_FONTS_DIR}/{input_name_base}",
-        ]
-    )
+    cache_key = None
+    if not options.get("no-cache"):
+        cache_key = make_hinting_cache_key(input_font_data)
+        cached_font_data = build_cache.fetch_data(
+            "ttfautohint", cache_key, "hinted.ttf"
+        )
+        if cached_font_data is not None:
+            hinting_cache_stats["hit"] += 1
+            print("hinting cache hit", input_font_path)
+            return restore_unhinted_tables(cached_font_data, input_font_data)
+        hinting_cache_stats["miss"] += 1
 
-    return ET.parse(f"{BUILD_FONTS_DIR}/{output_name_base}.ttx")
+    options_ = ttfautohint_options.parse_args(
+        # 出力ファイルの指定は必須のためダミーを渡す
+        [*HINTING_ARGS, input_font_path, os.devnull]
+    )
+    # 入力はバイト列で渡し、出力先を指定せずにバイト列で受け取る
+    options_["in_file"] = None
+    options_["in_buffer"] = input_font_data
+    options_["out_file"] = None
+    print("exec hinting", input_font_path, HINTING_ARGS)
+    hinted_font_data = ttfautohint(**options_)
+
+    if cache_key is not None:
+        build_cache.store_data("ttfautohint", cache_key, "hinted.ttf", hinted_font_data)
+    return hinted_font_data
+
+
+def make_hinting_cache_key(font_data: bytes) -> str:
+    """ヒンティング結果を左右するテーブルと引数からキャッシュキーを作成する"""
+    font = ttLib.TTFont(BytesIO(font_data))
+    table_data = [
+        font.getTableData(tag) if tag in font else b"" for tag in HINTING_INPUT_TABLES
+    ]
+    font.close()
+    # 生成日時が違うだけでキャッシュが無効にならないよう、head の日時とチェックサムを除く
+    head_index = HINTING_INPUT_TABLES.index("head")
+    head_data = bytearray(table_data[head_index])
+    for start, end in HEAD_VOLATILE_RANGES:
+        head_data[start:end] = bytes(len(head_data[start:end]))
+    table_data[head_index] = bytes(head_data)
+    return build_cache.make_key(table_data, HINTING_ARGS, ttfautohint_version)
+
+
+def restore_unhinted_tables(hinted_font_data: bytes, input_font_data: bytes) -> bytes:
+    """キャッシュしたヒンティング済みフォントに、ヒンティングと関係のないテーブルを入力フォントから戻す。
+    HS 版などはアウトラインが同じでもフォント名が異なるため、name テーブル等は入力フォントのものを使う。"""
+    hinted_font = ttLib.TTFont(BytesIO(hinted_font_data))
+    input_font = ttLib.TTFont(BytesIO(input_font_data))
+
+    # ヒンティングと関係のないテーブルはデコンパイルせずにバイト列のまま戻す
+    for tag in input_font.keys():
+        if tag in ["GlyphOrder", "name"] or tag in HINTING_OUTPUT_TABLES:
+            continue
+        table = DefaultTable(tag)
+        table.data = input_font.getTableData(tag)
+        hinted_font[tag] = table
+
+    # ttfautohint はバージョン文字列に情報を追記するため、追記部分を入力フォントのバージョン文字列に付け直す
+    version_suffixes = {}
+    for record in hinted_font["name"].names:
+        version = record.toUnicode()
+        if record.nameID == 5 and "; ttfautohint" in version:
+            version_suffixes[record.platformID, record.platEncID, record.langID] = (
+                version[version.index("; ttfautohint") :]
+            )
+    name_table = ttLib.newTable("name")
+    name_table.decompile(input_font.getTableData("name"), hinted_font)
+    for record in name_table.names:
+        key = (record.platformID, record.platEncID, record.langID)
+        if record.nameID == 5 and key in version_suffixes:
+            record.string = record.toUnicode() + version_suffixes[key]
+    hinted_font["name"] = name_table
+
+    font_data = BytesIO()
+    hinted_font.save(font_data)
+    return font_data.getvalue()
+
+
+@build_trace.traced
+def merge_fonts(eng_font_data: bytes, jp_font: ttLib.TTFont) -> ttLib.TTFont:
+    """英語フォントに日本語フォントのグリフを追加して結合する。
+    FontForge の処理で両フォントのコードポイントは重複せず、日本語フォントの GSUB, GPOS も空になっているため、
+    英語フォントのグリフ ID を変えずに日本語フォントのグリフを後ろに追加するだけで結合できる。
+    英語フォントのヒンティング・GSUB・GPOS などのテーブルはデコンパイルせずにバイト列のまま使い、
+    日本語フォントのグリフも複合グリフ以外はバイト列のまま追加する。
+    グリフ名の重複時の名前の付け方とテーブルの値の決め方は fontTools.merge.Merger に合わせる。"""
+    font = ttLib.TTFont(BytesIO(eng_font_data), recalcBBoxes=False)
+    if font["head"].unitsPerEm != jp_font["head"].unitsPerEm:
+        raise ValueError("unitsPerEm of the fonts to merge differ")
+    for tag in ["GSUB", "GPOS"]:
+        if tag in jp_font and jp_font[tag].table.LookupList is not None:
+            if jp_font[tag].table.LookupList.LookupCount > 0:
+                raise ValueError(f"{tag} lookups remain in the Japanese font")
+
+    # グリフ順を変更する前に、編集するテーブルを読み込んでおく
+    eng_glyph_order = font.getGlyphOrder()
+    for tag in ["head", "hhea", "maxp", "OS/2", "post", "hmtx", "glyf", "cmap"]:
+        font[tag]
+
+    # 英語フォントのグリフ名と重複する日本語フォントのグリフ名には `.1` などを付ける
+    mega_order = {glyph_name: 1 for glyph_name in eng_glyph_order}
+    renamed = {}
+    for glyph_name in jp_font.getGlyphOrder():
+        new_glyph_name = glyph_name
+        if glyph_name in mega_order:
+            n = mega_order[glyph_name]
+            while f"{glyph_name}.{n}" in mega_order:
+                n += 1
+            mega_order[glyph_name] = n
+            new_glyph_name = f"{glyph_name}.{n}"
+        mega_order[new_glyph_name] = 1
+        renamed[glyph_name] = new_glyph_name
+
+    merge_glyphs(font, jp_font, renamed)
+    font.setGlyphOrder(list(mega_order))
+    merge_cmap(font, jp_font, renamed)
+    merge_metric_tables(font, jp_font)
+
+    for tag in MERGE_DROP_TABLES:
+        if tag in font:
+            del font[tag]
+    return font
+
+
+def merge_glyphs(font: ttLib.TTFont, jp_font: ttLib.TTFont, renamed: dict):
+    """日本語フォントのグリフと送り幅を英語フォントの後ろに追加する"""
+    glyf_table = font["glyf"]
+    metrics = font["hmtx"].metrics
+    jp_glyf_table = jp_font["glyf"]
+    jp_metrics = jp_font["hmtx"].metrics
+    for glyph_name, new_glyph_name in renamed.items():
+        # 添字でアクセスすると展開されるため、展開前のグリフを取り出す
+        glyph = jp_glyf_table.glyphs[glyph_name]
+        if glyph.isComposite():
+            # 構成要素はグリフ ID で参照しているため、展開してグリフ名で参照し直す
+            glyph.expand(jp_glyf_table)
+            for component in glyph.components:
+                component.glyphName = renamed[component.glyphName]
+            glyph.removeHinting()
+        elif has_instructions(glyph):
+            # 英語フォントの fpgm, cvt とは対応しないため、日本語フォントの命令は削除する
+            glyph.expand(jp_glyf_table)
+            glyph.removeHinting()
+        glyf_table.glyphs[new_glyph_name] = glyph
+        metrics[new_glyph_name] = jp_metrics[glyph_name]
+
+
+def has_instructions(glyph) -> bool:
+    """展開前の単純グリフが命令を持つかどうかを返す"""
+    data = getattr(glyph, "data", None)
+    if not data:
+        return bool(getattr(glyph, "program", None))
+    number_of_contours = struct.unpack(">h", data[:2])[0]
+    if number_of_contours <= 0:
+        return False
+    # 輪郭数の直後に、境界ボックス (8 バイト) と各輪郭の終点 (2 バイトずつ) が続く
+    offset = 10 + 2 * number_of_contours
+    return struct.unpack(">H", data[offset : offset + 2])[0] > 0
+
+
+def merge_cmap(font: ttLib.TTFont, jp_font: ttLib.TTFont, renamed: dict):
+    """cmap を結合する。両フォントに同じコードポイントがある場合は英語フォントを優先する。
+    異体字シーケンス (format 14) のサブテーブルも結合する。"""
+    mapping = dict(font.getBestCmap() or {})
+    for codepoint, glyph_name in (jp_font.getBestCmap() or {}).items():
+        mapping.setdefault(codepoint, renamed[glyph_name])
+
+    uvs_dict = {}
+    for source_font, rename in [(font, None), (jp_font, renamed)]:
+        for table in source_font["cmap"].tables:
+            if table.format != 14:
+                continue
+            for selector, sequences in table.uvsDict.items():
+                merged_sequences = uvs_dict.setdefault(selector, {})
+                for base, glyph_name in sequences:
+                    if rename is not None and glyph_name is not None:
+                        glyph_name = rename[glyph_name]
+                    merged_sequences.setdefault(base, glyph_name)
+
+    tables = []
+    if uvs_dict:
+        table = cmap_classes[14](14)
+        table.platformID = 0
+        table.platEncID = 5
+        table.language = 0
+        table.cmap = {}
+        table.uvsDict = {
+            selector: sorted(sequences.items())
+            for selector, sequences in uvs_dict.items()
+        }
+        tables.append(table)
+    table = cmap_classes[4](4)
+    table.platformID = 3
+    table.platEncID = 1
+    table.language = 0
+    table.cmap = {
+        codepoint: glyph_name
+        for codepoint, glyph_name in mapping.items()
+        if codepoint <= 0xFFFF
+    }
+    tables.append(table)
+    if len(table.cmap) != len(mapping):
+        table = cmap_classes[12](12)
+        table.platformID = 3
+        table.platEncID = 10
+        table.language = 0
+        table.cmap = mapping
+        tables.append(table)
+
+    cmap_table = font["cmap"]
+    cmap_table.tableVersion = 0
+    cmap_table.tables = tables
+
+
+def merge_metric_tables(font: ttLib.TTFont, jp_font: ttLib.TTFont):
+    """head, hhea, maxp, OS/2, post テーブルの値を両フォントから決める。
+    境界ボックスなどは全グリフから計算し直さずに、両フォントの値の最大・最小を使う。"""
+    head_table = font["head"]
+    jp_head_table = jp_font["head"]
+    for name in HEAD_MAX_FIELDS:
+        setattr(
+            head_table,
+            name,
+            max(getattr(head_table, name), getattr(jp_head_table, name)),
+        )
+    for name in HEAD_MIN_FIELDS:
+        setattr(
+            head_table,
+            name,
+            min(getattr(head_table, name), getattr(jp_head_table, name)),
+        )
+    flags = head_table.flags | jp_head_table.flags
+    flags &= ~HEAD_FLAGS_AND_BITS | (head_table.flags & jp_head_table.flags)
+    head_table.flags = flags & ~HEAD_FLAGS_ZERO_BITS
+    head_table.created = timestampNow()
+
+    hhea_table = font["hhea"]
+    jp_hhea_table = jp_font["hhea"]
+    for name in HHEA_MAX_FIELDS:
+        setattr(
+            hhea_table,
+            name,
+            max(getattr(hhea_table, name), getattr(jp_hhea_table, name)),
+        )
+    for name in HHEA_MIN_FIELDS:
+        setattr(
+            hhea_table,
+            name,
+            min(getattr(hhea_table, name), getattr(jp_hhea_table, name)),
+        )
+
+    maxp_table = font["maxp"]
+    jp_maxp_table = jp_font["maxp"]
+    for name, value in vars(jp_maxp_table).items():
+        if name not in MAXP_FIRST_FIELDS and hasattr(maxp_table, name):
+            setattr(maxp_table, name, max(getattr(maxp_table, name), value))
+
+    os2_table = font["OS/2"]
+    jp_os2_table = jp_font["OS/2"]
+    for name in OS2_OR_FIELDS + OS2_MAX_FIELDS + OS2_MIN_FIELDS:
+        if not hasattr(os2_table, name) or not hasattr(jp_os2_table, name):
+            continue
+        values = [getattr(os2_table, name), getattr(jp_os2_table, name)]
+        if name in OS2_OR_FIELDS:
+            value = values[0] | values[1]
+        elif name in OS2_MAX_FIELDS:
+            value = max(values)
+        else:
+            value = min(values)
+        setattr(os2_table, name, value)
+    os2_table.fsType = mergeOs2FsType([os2_table.fsType, jp_os2_table.fsType])
+
+    # グリフ名はグリフ順から書き出し直す
+    post_table = font["post"]
+    post_table.formatType = max(post_table.formatType, jp_font["post"].formatType)
+    post_table.isFixedPitch = min(post_table.isFixedPitch, jp_font["post"].isFixedPitch)
+    post_table.extraNames = []
+    post_table.mapping = {}
+
+
+@build_trace.traced
+def fix_font_tables(font: ttLib.TTFont, style: str, variant: str):
+    """フォントテーブルを編集する"""
+    # OS/2 テーブルを編集
+    fix_os2_table(font, style, flag_hw=W35_WIDTH_STR not in variant)
+    # post テーブルを編集
+    fix_post_table(font, flag_hw=W35_WIDTH_STR not in variant)
 
 
-def fix_os2_table(xml: ET, style: str, flag_hw: bool = False):
+def fix_os2_table(font: ttLib.TTFont, style: str, flag_hw: bool = False):
     """OS/2 テーブルを編集する"""
+    os2_table = font["OS/2"]
+
     # xAvgCharWidthを編集
-    # タグ形式: <xAvgCharWidth value="1000"/>
     if flag_hw:
         x_avg_char_width = HALF_WIDTH_12
     else:
         x_avg_char_width = FULL_WIDTH_35
-    xml.find("OS_2/xAvgCharWidth").set("value", str(x_avg_char_width))
+    os2_table.xAvgCharWidth = x_avg_char_width
 
     # fsSelectionを編集
-    # タグ形式: <fsSelection value="00000000 11000000" />
     # スタイルに応じたビットを立てる
     fs_selection = None
     if style == "Regular":
-        fs_selection = "00000001 01000000"
+        fs_selection = 0b00000001_01000000
     elif style == "Italic":
-        fs_selection = "00000001 00000001"
+        fs_selection = 0b00000001_00000001
     elif style == "Bold":
-        fs_selection = "00000001 00100000"
+        fs_selection = 0b00000001_00100000
     elif style == "BoldItalic":
-        fs_selection = "00000001 00100001"
+        fs_selection = 0b00000001_00100001
 
     if fs_selection is not None:
-        xml.find("OS_2/fsSelection").set("value", fs_selection)
+        os2_table.fsSelection = fs_selection
 
     # panoseを編集
-    # タグ形式:
-    # <panose>
-    #   <bFamilyType value="2" />
-    #   <bSerifStyle value="11" />
-    #   <bWeight value="6" />
-    #   <bProportion value="9" />
-    #   <bContrast value="6" />
-    #   <bStrokeVariation value="3" />
-    #   <bArmStyle value="0" />
-    #   <bLetterForm value="2" />
-    #   <bMidline value="0" />
-    #   <bXHeight value="4" />
-    # </panose>
     if style == "Regular" or style == "Italic":
         bWeight = 5
     else:
@@ -245,33 +726,148 @@ def fix_os2_table(xml: ET, style: str, flag_hw: bool = False):
         }
 
     for key, value in panose.items():
-        xml.find(f"OS_2/panose/{key}").set("value", str(value))
+        setattr(os2_table.panose, key, value)
 
 
-def fix_post_table(xml: ET, flag_hw: bool = False):
+def fix_post_table(font: ttLib.TTFont, flag_hw: bool = False):
     """post テーブルを編集する"""
     # isFixedPitchを編集
-    # タグ形式: <isFixedPitch value="0"/>
     is_fixed_pitch = 1 if flag_hw else 0
-    xml.find("post/isFixedPitch").set("value", str(is_fixed_pitch))
-
-
-def fix_cmap_table(xml: ET, style: str, variant: str):
-    """異体字シーケンスを搭載するために cmap テーブルを編集する。
-    pyftmerge で結合すると異体字シーケンスを司るテーブル cmap_format_14 が
-    消えてしまうため、マージする前の編集済み日本語フォントから該当テーブル情報を取り出して適用する。"""
-    # タグ形式:
-    # <cmap_format_14 platformID="0" platEncID="5">
-    #   <map uv="0x4fae" uvs="0xfe00" name="uniFA30"/>
-    #   <map uv="0x50e7" uvs="0xfe00" name="uniFA31"/>
-    # </cmap_format_14>
-    source_xml = dump_ttx(
-        f"{FONTFORGE_PREFIX}{FONT_NAME}{variant}-{style}-jp.ttf",
-        f"{FONTFORGE_PREFIX}{FONT_NAME}{variant}-{style}-jp",
+    font["post"].isFixedPitch = is_fixed_pitch
+
+
+@build_trace.traced
+def build_variable_font(variant: str):
+    """ウェイトごとに生成したフォントをマスターとして、wght 軸の可変フォントを作成する"""
+    masters = []
+    for font_path in sorted(glob.glob(f"{BUILD_FONTS_DIR}/{FONT_NAME}{variant}-*.ttf")):
+        style = Path(font_path).stem.split("-")[1]
+        if style == VARIABLE_STYLE:
+            continue
+        font = ttLib.TTFont(font_path)
+        masters.append((style, font_path, font))
+    if len(masters) < 2:
+        print(f"Error: {FONT_NAME}{variant}-*.ttf masters not found")
+        sys.exit(1)
+    # ウェイト順に並べる
+    masters.sort(key=lambda master: master[2]["OS/2"].usWeightClass)
+    default_fonts = [
+        font
+        for _, _, font in masters
+        if font["OS/2"].usWeightClass == DEFAULT_WEIGHT_CLASS
+    ]
+    if len(default_fonts) == 0:
+        print(f"Error: master with usWeightClass {DEFAULT_WEIGHT_CLASS} not found")
+        sys.exit(1)
+    default_font = default_fonts[0]
+
+    for _, _, font in masters:
+        strip_hinting(font)
+
+    # 補間できないグリフを報告し、デフォルトのマスターと同じ形にして変化しないようにする
+    incompatible = neutralize_incompatible_glyphs(
+        default_font, [font for _, _, font in masters]
     )
-    source_cmap_format_14 = source_xml.find("cmap/cmap_format_14")
-    target_cmap = xml.find("cmap")
-    target_cmap.append(source_cmap_format_14)
+    # 一覧は build_script.py が可変フォントと一緒にリリースフォルダに移動する
+    report_path = (
+        f"{BUILD_FONTS_DIR}/{FONT_NAME}{variant}-{VARIABLE_STYLE}"
+        f"{INCOMPATIBLE_REPORT_SUFFIX}"
+    )
+    if os.path.exists(report_path):
+        # 前回作成した一覧を残さない
+        os.remove(report_path)
+    if incompatible:
+        with open(report_path, "w", encoding="utf-8") as f:
+            for glyph_name, reason in incompatible:
+                f.write(f"{glyph_name}\t{reason}\n")
+        print(
+            f"{len(incompatible)} incompatible glyphs neutralized (see {report_path})"
+        )
+
+    # マスターは読み込み済みのフォントを使うため、designspace はファイルに書き出さずに渡す
+    designspace = make_designspace(masters)
+    variable_font, _, _ = varLib.build(designspace)
+
+    output_path = f"{BUILD_FONTS_DIR}/{FONT_NAME}{variant}-{VARIABLE_STYLE}.ttf"
+    variable_font.save(output_path)
+    print(f"variable font: {output_path}")
+
+
+def strip_hinting(font: ttLib.TTFont):
+    """ヒンティング関連のテーブルとグリフの命令を削除する"""
+    for tag in VARIABLE_FONT_DROP_TABLES:
+        if tag in font:
+            del font[tag]
+    glyf_table = font["glyf"]
+    for glyph_name in font.getGlyphOrder():
+        glyf_table[glyph_name].removeHinting()
+
+
+def neutralize_incompatible_glyphs(default_font: ttLib.TTFont, fonts: list) -> list:
+    """デフォルトのマスターと輪郭の構造が異なるグリフを、デフォルトのマスターのグリフで置き換える。
+    置き換えたグリフ名と理由の一覧を返す。"""
+    default_glyf = default_font["glyf"]
+    incompatible = {}
+    for glyph_name in default_font.getGlyphOrder():
+        default_structure = glyph_structure(default_glyf, glyph_name)
+        for font in fonts:
+            if font is default_font:
+                continue
+            glyf_table = font["glyf"]
+            if glyph_name not in glyf_table:
+                # 欠けているグリフは可変フォントでは変化しないものとして扱われる
+                incompatible.setdefault(glyph_name, "missing in some masters")
+                continue
+            if glyph_structure(glyf_table, glyph_name) != default_structure:
+                incompatible[glyph_name] = "different outline structure"
+                glyf_table[glyph_name] = copy.deepcopy(default_glyf[glyph_name])
+                font["hmtx"][glyph_name] = default_font["hmtx"][glyph_name]
+    return sorted(incompatible.items())
+
+
+def glyph_structure(glyf_table, glyph_name: str) -> tuple:
+    """補間の可否を左右するグリフの構造 (輪郭の終点・オンカーブ点・コンポーネント) を返す"""
+    glyph = glyf_table[glyph_name]
+    if glyph.isComposite():
+        return ("composite", tuple(c.glyphName for c in glyph.components))
+    if glyph.numberOfContours <= 0:
+        return ("empty",)
+    return (
+        "simple",
+        tuple(glyph.endPtsOfContours),
+        tuple(flag & 1 for flag in glyph.flags),
+    )
+
+
+def make_designspace(masters: list) -> DesignSpaceDocument:
+    """各マスターの OS/2 usWeightClass からデザインスペースを作成する"""
+    weights = [font["OS/2"].usWeightClass for _, _, font in masters]
+    designspace = DesignSpaceDocument()
+    axis = AxisDescriptor()
+    axis.tag = "wght"
+    axis.name = "Weight"
+    axis.minimum = min(weights)
+    axis.default = DEFAULT_WEIGHT_CLASS
+    axis.maximum = max(weights)
+    designspace.addAxis(axis)
+
+    for (style, font_path, font), weight in zip(masters, weights):
+        family_name = font["name"].getBestFamilyName()
+        source = SourceDescriptor()
+        source.path = os.path.abspath(font_path)
+        # 輪郭を調整したマスターを使うため、ファイルではなくメモリ上のフォントを渡す
+        source.font = font
+        source.familyName = family_name
+        source.styleName = style
+        source.location = {axis.name: weight}
+        designspace.addSource(source)
+
+        instance = InstanceDescriptor()
+        instance.familyName = family_name
+        instance.styleName = style
+        instance.location = {axis.name: weight}
+        designspace.addInstance(instance)
+    return designspace
 
 
 if __name__ == "__main__":
@@ -0,0 +1,239 @@
+#!/bin/env python3
+
+# ビルドしたフォントのグリフごとの指紋 (輪郭のハッシュ値・送り幅・cmap の割り当て) を
+# ゴールデンインデックスとして保存し、2つのビルドの差分を比較する
+
+import configparser
+import glob
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from fontTools import ttLib
+
+# iniファイルを読み込む
+settings = configparser.ConfigParser()
+settings.read("build.ini", encoding="utf-8")
+
+FONTFORGE_PREFIX = settings.get("DEFAULT", "FONTFORGE_PREFIX")
+FONTTOOLS_PREFIX = settings.get("DEFAULT", "FONTTOOLS_PREFIX")
+
+# インデックスの形式のバージョン
+GOLDEN_INDEX_VERSION = 1
+# 1フォントあたりに表示する差分の最大件数
+MAX_REPORTED_GLYPHS = 10
+# 差分の種類
+DIFF_KINDS = ["added", "removed", "moved", "changed"]
+
+options = {}
+
+
+def main():
+    # オプション判定
+    get_options()
+    if options.get("unknown-option"):
+        usage()
+        sys.exit(1)
+
+    if options.get("save"):
+        source, index_path = options["save"]
+        index = load_index(source, options["jobs"])
+        save_index(index, index_path)
+        glyph_count = sum(len(glyphs) for glyphs in index["fonts"].values())
+        print(
+            f"{index_path}: {len(index['fonts'])} fonts, {glyph_count} glyphs "
+            f"({os.path.getsize(index_path) / 1024:.0f} KB)"
+        )
+    elif options.get("diff"):
+        old_source, new_source = options["diff"]
+        if diff_builds(old_source, new_source, options["jobs"]):
+            sys.exit(1)
+    else:
+        usage()
+        sys.exit(1)
+
+
+def usage():
+    print(f"Usage: {sys.argv[0]} --save <DIR> <INDEX> [--jobs <N>]")
+    print(f"       {sys.argv[0]} --diff <DIR | INDEX> <DIR | INDEX> [--jobs <N>]")
+
+
+def get_options():
+    """オプションを取得する"""
+
+    global options
+
+    options["jobs"] = os.cpu_count() or 1
+
+    args = iter(sys.argv[1:])
+    for arg in args:
+        # オプション判定
+        if arg in ("--save", "--diff"):
+            values = (next(args, None), next(args, None))
+            if None in values:
+                options["unknown-option"] = True
+                return
+            options[arg.removeprefix("--")] = values
+        elif arg == "--jobs":
+            value = next(args, "")
+            if not value.isdecimal() or int(value) < 1:
+                options["unknown-option"] = True
+                return
+            options["jobs"] = int(value)
+        else:
+            options["unknown-option"] = True
+            return
+
+
+def load_index(source: str, jobs: int) -> dict:
+    """ディレクトリならフォントから指紋を作成し、ファイルなら保存したインデックスを読み込む"""
+    if os.path.isfile(source):
+        with gzip.open(source, "rt", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") != GOLDEN_INDEX_VERSION:
+            print(f"Error: {source} is an unsupported index version")
+            sys.exit(1)
+        return index
+
+    font_paths = sorted(
+        path
+        for path in glob.glob(f"{source}/**/*.ttf", recursive=True)
+        # 中間ファイルは対象外
+        if not os.path.basename(path).startswith((FONTFORGE_PREFIX, FONTTOOLS_PREFIX))
+    )
+    if len(font_paths) == 0:
+        print(f"Error: no ttf files in {source}")
+        sys.exit(1)
+    # リリースフォルダの構成に依存しないよう、フォントはファイル名で区別する
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        fonts = dict(
+            zip(
+                [os.path.basename(path) for path in font_paths],
+                executor.map(fingerprint_font, font_paths),
+            )
+        )
+    return {"version": GOLDEN_INDEX_VERSION, "fonts": fonts}
+
+
+def save_index(index: dict, index_path: str):
+    """インデックスを gzip 圧縮した JSON で保存する"""
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    with gzip.open(index_path, "wt", encoding="utf-8") as f:
+        json.dump(index, f, separators=(",", ":"))
+
+
+def fingerprint_font(font_path: str) -> dict:
+    """グリフ名 → [グリフ ID, 輪郭のハッシュ値, 送り幅, 割り当て] の辞書を返す。
+    輪郭のハッシュ値は loca の位置で切り出した glyf の生データ (命令を含む) から求める。
+    割り当ては `4FAE` (cmap) と `4FAE:FE00` (異体字シーケンス) 形式の文字列のリスト。"""
+    font = ttLib.TTFont(font_path, lazy=True)
+    glyph_order = font.getGlyphOrder()
+    glyf_data = font.reader["glyf"]
+    locations = font["loca"].locations
+    metrics = font["hmtx"].metrics
+
+    best_cmap = font.getBestCmap() or {}
+    mappings = {}
+    for codepoint, glyph_name in best_cmap.items():
+        mappings.setdefault(glyph_name, []).append(f"{codepoint:04X}")
+    for table in font["cmap"].tables:
+        if table.format != 14:
+            continue
+        for selector, mapping in table.uvsDict.items():
+            for base, glyph_name in mapping:
+                # デフォルトのグリフを使うシーケンスは基底文字のグリフに割り当てる
+                if glyph_name is None:
+                    glyph_name = best_cmap.get(base)
+                    if glyph_name is None:
+                        continue
+                mappings.setdefault(glyph_name, []).append(f"{base:04X}:{selector:04X}")
+
+    glyphs = {}
+    for gid, glyph_name in enumerate(glyph_order):
+        data = glyf_data[locations[gid] : locations[gid + 1]]
+        glyphs[glyph_name] = [
+            gid,
+            hashlib.blake2b(data, digest_size=8).hexdigest(),
+            metrics[glyph_name][0],
+            sorted(mappings.get(glyph_name, [])),
+        ]
+    font.close()
+    return glyphs
+
+
+def diff_fonts(task: tuple) -> dict:
+    """2つのフォントの指紋を比較し、差分の種類ごとのグリフ名の一覧を返す。
+    moved は輪郭と送り幅が同じでグリフ ID か割り当てが変わったもの、
+    changed は輪郭か送り幅が変わったもの。"""
+    old_glyphs, new_glyphs = task
+    diff = {kind: [] for kind in DIFF_KINDS}
+    for glyph_name in sorted(new_glyphs.keys() - old_glyphs.keys()):
+        diff["added"].append(glyph_name)
+    for glyph_name in sorted(old_glyphs.keys() - new_glyphs.keys()):
+        diff["removed"].append(glyph_name)
+    for glyph_name in sorted(old_glyphs.keys() & new_glyphs.keys()):
+        old_gid, old_outline, old_advance, old_mapping = old_glyphs[glyph_name]
+        new_gid, new_outline, new_advance, new_mapping = new_glyphs[glyph_name]
+        if old_outline != new_outline or old_advance != new_advance:
+            diff["changed"].append(glyph_name)
+        elif old_gid != new_gid or old_mapping != new_mapping:
+            diff["moved"].append(glyph_name)
+    return diff
+
+
+def diff_builds(old_source: str, new_source: str, jobs: int) -> bool:
+    """2つのビルドの全フォントを比較して差分を表示する。差分があれば True を返す"""
+    start = time.monotonic()
+    old_index = load_index(old_source, jobs)
+    new_index = load_index(new_source, jobs)
+    old_fonts = old_index["fonts"]
+    new_fonts = new_index["fonts"]
+
+    font_names = sorted(old_fonts.keys() & new_fonts.keys())
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        diffs = list(
+            executor.map(
+                diff_fonts,
+                [(old_fonts[name], new_fonts[name]) for name in font_names],
+            )
+        )
+
+    has_diff = False
+    for font_name in sorted(new_fonts.keys() - old_fonts.keys()):
+        print(f"{font_name}: added font")
+        has_diff = True
+    for font_name in sorted(old_fonts.keys() - new_fonts.keys()):
+        print(f"{font_name}: removed font")
+        has_diff = True
+
+    totals = {kind: 0 for kind in DIFF_KINDS}
+    for font_name, diff in zip(font_names, diffs):
+        if not any(diff.values()):
+            continue
+        has_diff = True
+        print(
+            f"{font_name}: "
+            + ", ".join(f"{len(diff[kind])} {kind}" for kind in DIFF_KINDS)
+        )
+        for kind in DIFF_KINDS:
+            totals[kind] += len(diff[kind])
+            if diff[kind]:
+                names = diff[kind][:MAX_REPORTED_GLYPHS]
+                more = len(diff[kind]) - len(names)
+                print(
+                    f"  {kind}: {' '.join(names)}" + (f" ... (+{more})" if more else "")
+                )
+
+    print(
+        f"compared {len(font_names)} fonts in {time.monotonic() - start:.1f}s: "
+        + ", ".join(f"{totals[kind]} {kind}" for kind in DIFF_KINDS)
+    )
+    return has_diff
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/bin/env python3
+
+# リリースフォルダの各フォルダを zip に圧縮し、フォントごとの SHA-256 を記録したマニフェストを作成する
+# 同じ内容のフォルダからは常に同じ zip ができるよう、エントリの順序・日時・属性を固定する
+
+import configparser
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import build_cache
+
+# iniファイルを読み込む
+settings = configparser.ConfigParser()
+settings.read("build.ini", encoding="utf-8")
+
+VERSION = settings.get("DEFAULT", "VERSION")
+RELEASE_FILES_DIR = "release_files"
+MANIFEST_NAME = "manifest.json"
+# マニフェストにハッシュ値を記録するフォントの拡張子 (Web フォントを含む)
+FONT_EXTENSIONS = (".ttf", ".woff2", ".woff")
+
+# zip のエントリに設定する日時 (環境変数 SOURCE_DATE_EPOCH があればその日時)
+DEFAULT_ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+# zip のエントリに設定するファイル属性 (rw-r--r--)
+ZIP_FILE_MODE = 0o100644
+# zip のエントリを作成した OS (Unix)。実行環境によって変わらないよう固定する
+ZIP_CREATE_SYSTEM = 3
+
+options = {}
+
+
+def main():
+    # オプション判定
+    get_options()
+    if options.get("unknown-option"):
+        usage()
+        sys.exit(1)
+
+    release_dir = options.get("release-dir")
+    if release_dir is None:
+        # 指定がない場合は最新のリリースフォルダを対象にする
+        release_dirs = sorted(glob.glob(f"{RELEASE_FILES_DIR}/build_*"))
+        if len(release_dirs) == 0:
+            print(f"Error: {RELEASE_FILES_DIR}/build_* not found")
+            sys.exit(1)
+        release_dir = release_dirs[-1]
+
+    if not make_release_archives(release_dir, options["jobs"]):
+        sys.exit(1)
+
+
+def usage():
+    print(f"Usage: {sys.argv[0]} [<RELEASE_DIR>] [--jobs <N>]")
+
+
+def get_options():
+    """オプションを取得する"""
+
+    global options
+
+    options["jobs"] = os.cpu_count() or 1
+
+    args = iter(sys.argv[1:])
+    for arg in args:
+        # オプション判定
+        if arg == "--jobs":
+            value = next(args, "")
+            if not value.isdecimal() or int(value) < 1:
+                options["unknown-option"] = True
+                return
+            options["jobs"] = int(value)
+        elif arg.startswith("--"):
+            options["unknown-option"] = True
+            return
+        else:
+            options["release-dir"] = arg
+
+
+def make_release_archives(release_dir: str, jobs: int) -> bool:
+    """リリースフォルダ直下の各フォルダを並列に zip に圧縮し、マニフェストを書き出す。
+    例: NOTONOTO_v0.0.3/ -> NOTONOTO_v0.0.3.zip"""
+    folder_names = [
+        folder_name
+        for folder_name in sorted(os.listdir(release_dir))
+        if os.path.isdir(f"{release_dir}/{folder_name}")
+    ]
+    if len(folder_names) == 0:
+        print(f"Error: no release folders in {release_dir}")
+        return False
+
+    # 圧縮は CPU 負荷が高いため、zip ごとにプロセスを分けて並列に処理する
+    start = time.monotonic()
+    manifest = {"version": VERSION, "archives": {}, "fonts": {}}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for archive, files in executor.map(
+            make_archive, [(release_dir, folder_name) for folder_name in folder_names]
+        ):
+            print(
+                f"{release_dir}/{archive['name']}: {len(files)} files, "
+                f"{archive['size'] / 1024 / 1024:.1f} MB ({archive['elapsed']:.1f}s)"
+            )
+            manifest["archives"][archive["name"]] = {
+                "sha256": archive["sha256"],
+                "size": archive["size"],
+            }
+            for file in files:
+                if file["name"].endswith(FONT_EXTENSIONS):
+                    manifest["fonts"][file["name"]] = {
+                        "sha256": file["sha256"],
+                        "size": file["size"],
+                    }
+
+    manifest_path = f"{release_dir}/{MANIFEST_NAME}"
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(
+        f"{manifest_path}: {len(manifest['fonts'])} fonts, "
+        f"{len(manifest['archives'])} archives"
+    )
+    print(f"packaging finished in {time.monotonic() - start:.1f}s")
+    return True
+
+
+def zip_date_time() -> tuple:
+    """zip のエントリに設定する日時を返す"""
+    source_date_epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    if source_date_epoch is None or not source_date_epoch.isdecimal():
+        return DEFAULT_ZIP_DATE_TIME
+    # zip の日時は 1980 年以降しか表せない
+    date_time = time.gmtime(int(source_date_epoch))[:6]
+    return max(date_time, DEFAULT_ZIP_DATE_TIME)
+
+
+def make_archive(task: tuple):
+    """フォルダを zip に圧縮し、zip と含まれる各ファイルのサイズ・SHA-256 を返す。
+    ファイル名はリリースフォルダからの相対パスで、zip 内でもフォルダ名から始まる。"""
+    release_dir, folder_name = task
+    start = time.perf_counter()
+    date_time = zip_date_time()
+
+    paths = sorted(
+        os.path.relpath(path, release_dir).replace(os.sep, "/")
+        for path in glob.glob(f"{release_dir}/{folder_name}/**/*", recursive=True)
+        if os.path.isfile(path)
+    )
+
+    archive_path = f"{release_dir}/{folder_name}.zip"
+    # 途中で失敗した zip が残らないよう、一時ファイルに書いてからリネームする
+    tmp_archive_path = f"{archive_path}.tmp"
+    files = []
+    with zipfile.ZipFile(tmp_archive_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name in paths:
+            with open(f"{release_dir}/{name}", "rb") as f:
+                data = f.read()
+            info = zipfile.ZipInfo(name, date_time=date_time)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.create_system = ZIP_CREATE_SYSTEM
+            info.external_attr = ZIP_FILE_MODE << 16
+            archive.writestr(info, data)
+            files.append(
+                {
+                    "name": name,
+                    "sha256": hashlib.sha256(data).hexdigest(),
+                    "size": len(data),
+                }
+            )
+    os.replace(tmp_archive_path, archive_path)
+
+    archive = {
+        "name": os.path.basename(archive_path),
+        "sha256": build_cache.file_digest(archive_path),
+        "size": os.path.getsize(archive_path),
+        "elapsed": time.perf_counter() - start,
+    }
+    return archive, files
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,437 @@
+#!/bin/env python3
+
+# ビルドしたフォントから、指定したコードポイントだけを含む WOFF2 を作成する
+# コマンドラインで1回だけ作成するほか、ローカルの HTTP サーバーとして常駐し、
+# 作成結果をサイズ上限付きの LRU キャッシュに保持して再利用する
+
+import configparser
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+from fontTools import subset, ttLib
+
+import build_cache
+
+# iniファイルを読み込む
+settings = configparser.ConfigParser()
+settings.read("build.ini", encoding="utf-8")
+
+BUILD_FONTS_DIR = settings.get("DEFAULT", "BUILD_FONTS_DIR")
+RELEASE_FILES_DIR = "release_files"
+
+# LRU キャッシュの既定の上限サイズ (MB)
+DEFAULT_CACHE_SIZE_MB = 256
+# レイテンシの統計に使う直近のリクエスト数
+LATENCY_WINDOW = 1000
+
+options = {}
+
+
+def main():
+    # オプション判定
+    get_options()
+    if options.get("unknown-option"):
+        usage()
+        sys.exit(1)
+
+    if options.get("serve"):
+        serve(options["serve"], options["font-dir"], options["cache-size"])
+        return
+
+    if options.get("font") is None or options.get("codepoints") is None:
+        usage()
+        sys.exit(1)
+
+    start = time.perf_counter()
+    data = subset_font(options["font"], options["codepoints"])
+    output_path = options.get("output") or (
+        f"{os.path.splitext(os.path.basename(options['font']))[0]}-subset.woff2"
+    )
+    with open(output_path, "wb") as f:
+        f.write(data)
+    print(
+        f"{output_path}: {len(options['codepoints'])} codepoints, "
+        f"{len(data) / 1024:.1f} KB ({time.perf_counter() - start:.2f}s)"
+    )
+
+
+def usage():
+    print(
+        f"Usage: {sys.argv[0]} <FONT> (--unicodes <RANGES> | --text <TEXT> | "
+        "--text-file <FILE>) [--output <FILE>]"
+    )
+    print(
+        f"       {sys.argv[0]} --serve <HOST:PORT> [--font-dir <DIR>] "
+        "[--cache-size <MB>]"
+    )
+
+
+def get_options():
+    """オプションを取得する"""
+
+    global options
+
+    options["cache-size"] = DEFAULT_CACHE_SIZE_MB
+
+    args = iter(sys.argv[1:])
+    for arg in args:
+        # オプション判定
+        if arg in ("--unicodes", "--text", "--text-file"):
+            value = next(args, None)
+            if value is None:
+                options["unknown-option"] = True
+                return
+            try:
+                if arg == "--unicodes":
+                    codepoints = parse_unicodes(value)
+                elif arg == "--text":
+                    codepoints = {ord(c) for c in value}
+                else:
+                    with open(value, encoding="utf-8") as f:
+                        codepoints = {ord(c) for c in f.read()}
+            except (ValueError, OSError) as e:
+                print(f"Error: {e}")
+                options["unknown-option"] = True
+                return
+            options.setdefault("codepoints", set()).update(codepoints)
+        elif arg == "--output":
+            value = next(args, None)
+            if value is None:
+                options["unknown-option"] = True
+                return
+            options["output"] = value
+        elif arg == "--serve":
+            value = next(args, None)
+            if value is None or ":" not in value:
+                options["unknown-option"] = True
+                return
+            options["serve"] = value
+        elif arg == "--font-dir":
+            value = next(args, None)
+            if value is None:
+                options["unknown-option"] = True
+                return
+            options["font-dir"] = value
+        elif arg == "--cache-size":
+            value = next(args, "")
+            if not value.isdecimal():
+                options["unknown-option"] = True
+                return
+            options["cache-size"] = int(value)
+        elif arg.startswith("--"):
+            options["unknown-option"] = True
+            return
+        else:
+            options["font"] = arg
+
+    if options.get("serve") and options.get("font-dir") is None:
+        options["font-dir"] = default_font_dir()
+
+
+def default_font_dir() -> str:
+    """最新のリリースフォルダを返す。なければビルドディレクトリを返す"""
+    release_dirs = sorted(glob.glob(f"{RELEASE_FILES_DIR}/build_*"))
+    if release_dirs:
+        return release_dirs[-1]
+    return BUILD_FONTS_DIR
+
+
+def parse_unicodes(value: str) -> set:
+    """`U+3040-309F,U+4E00` 形式の Unicode 範囲のリストをコードポイントの集合に変換する"""
+    codepoints = set()
+    for item in value.split(","):
+        item = item.strip()
+        if item == "":
+            continue
+        start, _, end = item.partition("-")
+        start = parse_codepoint(start)
+        end = parse_codepoint(end) if end else start
+        if start > end:
+            raise ValueError(f"invalid range: {item}")
+        codepoints.update(range(start, end + 1))
+    return codepoints
+
+
+def parse_codepoint(value: str) -> int:
+    """`U+3042` や `3042` をコードポイントに変換する"""
+    value = value.strip().upper()
+    return int(value.removeprefix("U+").removeprefix("0X"), 16)
+
+
+def subset_font(font_path: str, codepoints: set) -> bytes:
+    """フォントをコードポイントでサブセット化し、WOFF2 のバイト列を返す"""
+    subset_options = subset.Options()
+    # 名前・ヒンティング・レイアウト機能は元のフォントのまま残す
+    subset_options.name_IDs = ["*"]
+    subset_options.name_languages = ["*"]
+    subset_options.layout_features = ["*"]
+    subset_options.notdef_outline = True
+    subset_options.recalc_timestamp = False
+
+    font = ttLib.TTFont(font_path, recalcTimestamp=False)
+    original_variations = variation_sequences(font, codepoints)
+    subsetter = subset.Subsetter(options=subset_options)
+    subsetter.populate(unicodes=codepoints)
+    subsetter.subset(font)
+
+    # 異体字セレクタ (cmap format 14) が失われていないことを確認する
+    missing = original_variations - variation_sequences(font, codepoints)
+    if missing:
+        raise ValueError(
+            f"{len(missing)} variation sequences lost in subset: "
+            + ", ".join(
+                f"U+{base:04X} U+{selector:04X}"
+                for base, selector in sorted({sequence[:2] for sequence in missing})
+            )
+        )
+
+    # Subsetter はオプションの flavor を使わないため、保存するフォントに指定する
+    font.flavor = "woff2"
+    output = BytesIO()
+    font.save(output)
+    font.close()
+    data = output.getvalue()
+    if not data.startswith(b"wOF2"):
+        raise ValueError("subset font was not saved as WOFF2")
+    return data
+
+
+def variation_sequences(font: ttLib.TTFont, codepoints: set) -> set:
+    """基底文字が codepoints に含まれる異体字シーケンスを (基底文字, セレクタ, グリフ名) の集合で返す。
+    デフォルトのグリフを使うシーケンスのグリフ名は None"""
+    sequences = set()
+    for table in font["cmap"].tables:
+        if table.format != 14:
+            continue
+        for selector, mappings in table.uvsDict.items():
+            for base, glyph_name in mappings:
+                if base in codepoints:
+                    sequences.add((base, selector, glyph_name))
+    return sequences
+
+
+class SubsetCache:
+    """サブセット化した WOFF2 を保持する、合計サイズ上限付きの LRU キャッシュ"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: str, data: bytes):
+        with self.lock:
+            if key in self.entries or len(data) > self.max_size:
+                return
+            self.entries[key] = data
+            self.size += len(data)
+            # 最後に使われた日時が古いエントリから削除する
+            while self.size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def metrics(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "size_bytes": self.size,
+                "max_size_bytes": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+            }
+
+
+class SubsetService:
+    """フォントディレクトリ内のフォントをサブセット化し、結果をキャッシュする"""
+
+    def __init__(self, font_dir: str, cache_size_mb: int):
+        self.font_dir = font_dir
+        self.cache = SubsetCache(cache_size_mb * 1024 * 1024)
+        # フォントファイル名 → パス (ファイル名以外での指定を受け付けないようにする)
+        self.fonts = {
+            os.path.basename(path): path
+            for path in sorted(glob.glob(f"{font_dir}/**/*.ttf", recursive=True))
+        }
+        # パス → (更新日時, サイズ, SHA-256)
+        self.font_digests = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.latencies = {
+            "hit": deque(maxlen=LATENCY_WINDOW),
+            "miss": deque(maxlen=LATENCY_WINDOW),
+        }
+
+    def font_digest(self, path: str) -> str:
+        """フォントファイルのハッシュ値を返す。ファイルが更新されていなければ前回の値を使う"""
+        stat = os.stat(path)
+        with self.lock:
+            cached = self.font_digests.get(path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        digest = build_cache.file_digest(path)
+        with self.lock:
+            self.font_digests[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def subset(self, font_name: str, codepoints: set):
+        """サブセット化した WOFF2 と、キャッシュにあったかどうかを返す"""
+        start = time.perf_counter()
+        font_path = self.fonts.get(font_name)
+        if font_path is None:
+            raise KeyError(font_name)
+        key = build_cache.make_key(self.font_digest(font_path), sorted(codepoints))
+        data = self.cache.get(key)
+        hit = data is not None
+        if not hit:
+            data = subset_font(font_path, codepoints)
+            self.cache.put(key, data)
+        self.record(hit, time.perf_counter() - start)
+        return data, hit
+
+    def record(self, hit: bool, elapsed: float):
+        with self.lock:
+            self.requests += 1
+            self.latencies["hit" if hit else "miss"].append(elapsed * 1000)
+
+    def record_error(self):
+        with self.lock:
+            self.requests += 1
+            self.errors += 1
+
+    def metrics(self) -> dict:
+        with self.lock:
+            latencies = {
+                name: latency_summary(list(values))
+                for name, values in self.latencies.items()
+            }
+            requests = self.requests
+            errors = self.errors
+        return {
+            "requests": requests,
+            "errors": errors,
+            "cache": self.cache.metrics(),
+            "latency_ms": latencies,
+            "fonts": len(self.fonts),
+        }
+
+
+def latency_summary(values: list) -> dict:
+    """レイテンシ (ms) の件数・平均・中央値・95パーセンタイルを返す"""
+    if not values:
+        return {"count": 0}
+    values.sort()
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 2),
+        "p50": round(values[len(values) // 2], 2),
+        "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 2),
+    }
+
+
+class SubsetRequestHandler(BaseHTTPRequestHandler):
+    """GET /subset?font=<FILE>&unicodes=<RANGES>&text=<TEXT> と GET /metrics を処理する"""
+
+    service = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/metrics":
+            self.send_body(
+                200,
+                "application/json",
+                json.dumps(self.service.metrics(), indent=1).encode("utf-8"),
+            )
+        elif url.path == "/subset":
+            self.handle_subset(parse_qs(url.query))
+        else:
+            self.send_body(404, "text/plain", b"not found\n")
+
+    def handle_subset(self, query: dict):
+        font_name = query.get("font", [None])[0]
+        try:
+            codepoints = set()
+            for value in query.get("unicodes", []):
+                codepoints.update(parse_unicodes(value))
+            for value in query.get("text", []):
+                codepoints.update(ord(c) for c in value)
+        except ValueError as e:
+            self.service.record_error()
+            self.send_body(400, "text/plain", f"{e}\n".encode("utf-8"))
+            return
+        if font_name is None or not codepoints:
+            self.service.record_error()
+            self.send_body(400, "text/plain", b"font and unicodes or text required\n")
+            return
+
+        try:
+            data, hit = self.service.subset(font_name, codepoints)
+        except KeyError:
+            self.service.record_error()
+            self.send_body(
+                404, "text/plain", f"{font_name} not found\n".encode("utf-8")
+            )
+            return
+        except Exception as e:
+            self.service.record_error()
+            self.send_body(500, "text/plain", f"{e}\n".encode("utf-8"))
+            return
+        self.send_body(200, "font/woff2", data, {"X-Cache": "HIT" if hit else "MISS"})
+
+    def send_body(self, status: int, content_type: str, body: bytes, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(address: str, font_dir: str, cache_size_mb: int):
+    """HTTP サーバーとして常駐する。ローカルでの利用のみを想定している"""
+    host, _, port = address.rpartition(":")
+    if not port.isdecimal():
+        print(f"Error: invalid address {address}")
+        sys.exit(1)
+    SubsetRequestHandler.service = SubsetService(font_dir, cache_size_mb)
+    server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), SubsetRequestHandler)
+    print(
+        f"serving {len(SubsetRequestHandler.service.fonts)} fonts in {font_dir} "
+        f"on http://{host or '127.0.0.1'}:{port} (cache {cache_size_mb} MB)"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
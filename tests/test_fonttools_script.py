@@ -0,0 +1,47 @@
+import os
+import sys
+from io import BytesIO
+
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+# スクリプトは build.ini をカレントディレクトリから読み込む
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import fonttools_script  # noqa: E402
+
+
+def make_font_data(win_ascent=900, created=0) -> bytes:
+    """ヒンティングキャッシュのキーの確認用に、1グリフだけのフォントを作成する"""
+    pen = TTGlyphPen(None)
+    pen.moveTo((100, 0))
+    pen.lineTo((100, 700))
+    pen.lineTo((400, 700))
+    pen.closePath()
+
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder([".notdef", "A"])
+    builder.setupCharacterMap({0x41: "A"})
+    builder.setupGlyf({".notdef": TTGlyphPen(None).glyph(), "A": pen.glyph()})
+    builder.setupHorizontalMetrics({".notdef": (500, 0), "A": (500, 100)})
+    builder.setupHorizontalHeader(ascent=880, descent=-120)
+    builder.setupOS2(usWinAscent=win_ascent, usWinDescent=250)
+    builder.setupPost()
+    builder.updateHead(created=created, modified=created)
+    output = BytesIO()
+    builder.font.save(output)
+    return output.getvalue()
+
+
+def test_hinting_cache_key_changes_with_win_ascent():
+    assert fonttools_script.make_hinting_cache_key(
+        make_font_data(win_ascent=900)
+    ) != fonttools_script.make_hinting_cache_key(make_font_data(win_ascent=950))
+
+
+def test_hinting_cache_key_ignores_timestamps():
+    assert fonttools_script.make_hinting_cache_key(
+        make_font_data(created=0)
+    ) == fonttools_script.make_hinting_cache_key(make_font_data(created=3600))
@@ -0,0 +1,219 @@
+#!/bin/env python3
+
+# ビルドしたフォントのメトリクスを検証する
+# cmap で割り当てられた全グリフの送り幅が半角幅・全角幅のどちらかであることと、
+# OS/2・post テーブルの等幅フォント用の値が fonttools_script.py で設定した値のままであることを確認する
+
+import configparser
+import copy
+import glob
+import os
+import sys
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from fontTools import ttLib
+
+import fonttools_script
+
+# iniファイルを読み込む
+settings = configparser.ConfigParser()
+settings.read("build.ini", encoding="utf-8")
+
+BUILD_FONTS_DIR = settings.get("DEFAULT", "BUILD_FONTS_DIR")
+W35_WIDTH_STR = settings.get("DEFAULT", "W35_WIDTH_STR")
+HALF_WIDTH_12 = int(settings.get("DEFAULT", "HALF_WIDTH_12"))
+FULL_WIDTH_35 = int(settings.get("DEFAULT", "FULL_WIDTH_35"))
+RELEASE_FILES_DIR = "release_files"
+
+# 3:5 幅版の半角幅 (fontforge_script.py の to_monospace と同じ値)
+HALF_WIDTH_35 = 600
+# 送り幅 0 を許す一般カテゴリ (結合記号・書式制御文字)
+ZERO_WIDTH_CATEGORIES = ["Mn", "Me", "Cf"]
+# 1フォントあたりに表示する違反の最大件数
+MAX_REPORTED_ERRORS = 20
+
+options = {}
+
+
+def main():
+    # オプション判定
+    get_options()
+    if options.get("unknown-option"):
+        usage()
+        sys.exit(1)
+
+    target_dir = options.get("target-dir")
+    if target_dir is None:
+        # 指定がない場合は最新のリリースフォルダを対象にする
+        release_dirs = sorted(glob.glob(f"{RELEASE_FILES_DIR}/build_*"))
+        target_dir = release_dirs[-1] if release_dirs else BUILD_FONTS_DIR
+
+    if not validate_fonts(target_dir, options["jobs"]):
+        sys.exit(1)
+
+
+def usage():
+    print(f"Usage: {sys.argv[0]} [<DIR>] [--jobs <N>]")
+
+
+def get_options():
+    """オプションを取得する"""
+
+    global options
+
+    options["jobs"] = os.cpu_count() or 1
+
+    args = iter(sys.argv[1:])
+    for arg in args:
+        # オプション判定
+        if arg == "--jobs":
+            value = next(args, "")
+            if not value.isdecimal() or int(value) < 1:
+                options["unknown-option"] = True
+                return
+            options["jobs"] = int(value)
+        elif arg.startswith("--"):
+            options["unknown-option"] = True
+            return
+        else:
+            options["target-dir"] = arg
+
+
+def validate_fonts(target_dir: str, jobs: int) -> bool:
+    """ディレクトリ以下の ttf を並列に検証し、全て問題なければ True を返す"""
+    font_paths = sorted(
+        path
+        for path in glob.glob(f"{target_dir}/**/*.ttf", recursive=True)
+        # 中間ファイルは対象外
+        if not os.path.basename(path).startswith(
+            (fonttools_script.FONTFORGE_PREFIX, fonttools_script.FONTTOOLS_PREFIX)
+        )
+    )
+    if len(font_paths) == 0:
+        print(f"Error: no ttf files in {target_dir}")
+        return False
+
+    start = time.monotonic()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for font_path, errors in zip(
+            font_paths, executor.map(validate_font, font_paths)
+        ):
+            if not errors:
+                continue
+            failed += 1
+            print(f"{font_path}: {len(errors)} errors")
+            for error in errors[:MAX_REPORTED_ERRORS]:
+                print(f"  {error}")
+            if len(errors) > MAX_REPORTED_ERRORS:
+                print(f"  ... and {len(errors) - MAX_REPORTED_ERRORS} more")
+    print(
+        f"validated {len(font_paths)} fonts in {time.monotonic() - start:.1f}s, "
+        f"{failed} failed"
+    )
+    return failed == 0
+
+
+def validate_font(font_path: str) -> list:
+    """フォントを検証し、違反内容の一覧を返す"""
+    # ファイル名は {FONT_NAME}{バリエーション}-{スタイル}.ttf
+    variant, _, style = Path(font_path).stem.partition("-")
+    if style == fonttools_script.VARIABLE_STYLE:
+        # 可変フォントのテーブルはデフォルトのマスターのものを引き継いでいる
+        style = "Regular"
+    flag_hw = W35_WIDTH_STR not in variant
+
+    font = ttLib.TTFont(font_path, lazy=True)
+    errors = validate_advances(font, flag_hw)
+    errors.extend(validate_monospace_flags(font, style, flag_hw))
+    font.close()
+    return errors
+
+
+def validate_advances(font: ttLib.TTFont, flag_hw: bool) -> list:
+    """cmap で割り当てられたグリフの送り幅が、半角幅・全角幅のどちらかであることを確認する"""
+    if flag_hw:
+        allowed = np.array([HALF_WIDTH_12, HALF_WIDTH_12 * 2])
+    else:
+        allowed = np.array([HALF_WIDTH_35, FULL_WIDTH_35])
+
+    glyph_order = font.getGlyphOrder()
+    glyph_ids = {glyph_name: i for i, glyph_name in enumerate(glyph_order)}
+    metrics = font["hmtx"].metrics
+    advances = np.fromiter(
+        (metrics[glyph_name][0] for glyph_name in glyph_order),
+        dtype=np.int32,
+        count=len(glyph_order),
+    )
+
+    # コードポイントとグリフ名の組。異体字シーケンスで割り当てられたグリフは基底文字のコードポイントで扱う
+    pairs = list((font.getBestCmap() or {}).items())
+    for table in font["cmap"].tables:
+        if table.format != 14:
+            continue
+        for mapping in table.uvsDict.values():
+            pairs.extend(
+                (base, glyph_name)
+                for base, glyph_name in mapping
+                if glyph_name is not None
+            )
+    codepoints = np.fromiter(
+        (codepoint for codepoint, _ in pairs), dtype=np.int64, count=len(pairs)
+    )
+    gids = np.fromiter(
+        (glyph_ids[glyph_name] for _, glyph_name in pairs),
+        dtype=np.int64,
+        count=len(pairs),
+    )
+
+    mapped_advances = advances[gids]
+    invalid = ~np.isin(mapped_advances, allowed)
+    # 送り幅 0 は結合記号・書式制御文字のみ許す (該当するものは少ないため個別に判定する)
+    for i in np.flatnonzero(invalid & (mapped_advances == 0)):
+        if unicodedata.category(chr(codepoints[i])) in ZERO_WIDTH_CATEGORIES:
+            invalid[i] = False
+
+    errors = []
+    for i in np.flatnonzero(invalid):
+        errors.append(
+            f"U+{codepoints[i]:04X} ({glyph_order[gids[i]]}): "
+            f"advance {mapped_advances[i]} not in {allowed.tolist()}"
+        )
+    return errors
+
+
+def validate_monospace_flags(font: ttLib.TTFont, style: str, flag_hw: bool) -> list:
+    """xAvgCharWidth・isFixedPitch・panose が fonttools_script.py で設定する値と一致することを確認する"""
+    # 同じ処理を複製したテーブルに適用して期待値を求める
+    expected = ttLib.TTFont()
+    expected["OS/2"] = copy.deepcopy(font["OS/2"])
+    expected["post"] = copy.deepcopy(font["post"])
+    fonttools_script.fix_os2_table(expected, style, flag_hw=flag_hw)
+    fonttools_script.fix_post_table(expected, flag_hw=flag_hw)
+
+    errors = []
+    os2_table = font["OS/2"]
+    expected_os2_table = expected["OS/2"]
+    if os2_table.xAvgCharWidth != expected_os2_table.xAvgCharWidth:
+        errors.append(
+            f"OS/2 xAvgCharWidth {os2_table.xAvgCharWidth} "
+            f"!= {expected_os2_table.xAvgCharWidth}"
+        )
+    if font["post"].isFixedPitch != expected["post"].isFixedPitch:
+        errors.append(
+            f"post isFixedPitch {font['post'].isFixedPitch} "
+            f"!= {expected['post'].isFixedPitch}"
+        )
+    if vars(os2_table.panose) != vars(expected_os2_table.panose):
+        errors.append(
+            f"OS/2 panose {vars(os2_table.panose)} != {vars(expected_os2_table.panose)}"
+        )
+    return errors
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/bin/env python3
+
+# リリースフォルダの ttf から Web フォント (WOFF2, WOFF) を作成する
+
+import configparser
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from fontTools import ttLib
+
+# iniファイルを読み込む
+settings = configparser.ConfigParser()
+settings.read("build.ini", encoding="utf-8")
+
+VERSION = settings.get("DEFAULT", "VERSION")
+FONT_NAME = settings.get("DEFAULT", "FONT_NAME")
+RELEASE_FILES_DIR = "release_files"
+WEB_STR = "WEB"
+
+# 作成する Web フォントの形式
+FLAVORS = ["woff2", "woff"]
+
+options = {}
+
+
+def main():
+    # オプション判定
+    get_options()
+    if options.get("unknown-option"):
+        usage()
+        sys.exit(1)
+
+    release_dir = options.get("release-dir")
+    if release_dir is None:
+        # 指定がない場合は最新のリリースフォルダを対象にする
+        release_dirs = sorted(glob.glob(f"{RELEASE_FILES_DIR}/build_*"))
+        if len(release_dirs) == 0:
+            print(f"Error: {RELEASE_FILES_DIR}/build_* not found")
+            sys.exit(1)
+        release_dir = release_dirs[-1]
+
+    make_web_fonts(release_dir, options["jobs"])
+
+
+def usage():
+    print(f"Usage: {sys.argv[0]} [<RELEASE_DIR>] [--jobs <N>]")
+
+
+def get_options():
+    """オプションを取得する"""
+
+    global options
+
+    options["jobs"] = os.cpu_count() or 1
+
+    args = iter(sys.argv[1:])
+    for arg in args:
+        # オプション判定
+        if arg == "--jobs":
+            value = next(args, "")
+            if not value.isdecimal() or int(value) < 1:
+                options["unknown-option"] = True
+                return
+            options["jobs"] = int(value)
+        elif arg.startswith("--"):
+            options["unknown-option"] = True
+            return
+        else:
+            options["release-dir"] = arg
+
+
+def make_web_fonts(release_dir: str, jobs: int):
+    """リリースフォルダ内の各フォルダの ttf を圧縮し、隣に Web フォント用のフォルダを作成する。
+    例: NOTONOTO_v0.0.3/NOTONOTO35/*.ttf -> NOTONOTO_WEB_v0.0.3/NOTONOTO35/*.woff2"""
+    tasks = []
+    for folder_name in sorted(os.listdir(release_dir)):
+        folder_path = f"{release_dir}/{folder_name}"
+        if not os.path.isdir(folder_path) or f"_{WEB_STR}_" in folder_name:
+            continue
+        web_folder_path = f"{release_dir}/{web_folder_name(folder_name)}"
+        for font_path in sorted(glob.glob(f"{folder_path}/**/*.ttf", recursive=True)):
+            relative_path = os.path.relpath(font_path, folder_path)
+            for flavor in FLAVORS:
+                web_font_path = (
+                    f"{web_folder_path}/{os.path.splitext(relative_path)[0]}.{flavor}"
+                )
+                tasks.append((font_path, web_font_path, flavor))
+
+    if len(tasks) == 0:
+        print(f"Error: no ttf files in {release_dir}")
+        return
+
+    # Brotli による圧縮は CPU 負荷が高いため、ファイルごとにプロセスを分けて並列に処理する
+    start = time.monotonic()
+    total_size = 0
+    total_compressed_size = {flavor: 0 for flavor in FLAVORS}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for result in executor.map(compress_font, tasks):
+            _, web_font_path, flavor, size, compressed_size, elapsed = result
+            print(
+                f"{web_font_path}: {size / 1024:.0f} KB -> "
+                f"{compressed_size / 1024:.0f} KB "
+                f"({compressed_size / size:.1%}, {elapsed:.1f}s)"
+            )
+            if flavor == FLAVORS[0]:
+                total_size += size
+            total_compressed_size[flavor] += compressed_size
+
+    for flavor in FLAVORS:
+        print(
+            f"{flavor}: {total_size / 1024 / 1024:.1f} MB -> "
+            f"{total_compressed_size[flavor] / 1024 / 1024:.1f} MB"
+        )
+    print(f"web fonts finished in {time.monotonic() - start:.1f}s")
+
+
+def web_folder_name(folder_name: str) -> str:
+    """リリースフォルダ名から Web フォント用のフォルダ名を求める。
+    例: NOTONOTO_HS_v0.0.3 -> NOTONOTO_HS_WEB_v0.0.3"""
+    return f"{folder_name.removesuffix(f'_{VERSION}')}_{WEB_STR}_{VERSION}"
+
+
+def compress_font(task: tuple):
+    """ttf を WOFF2 または WOFF で保存し、サイズと所要時間を返す"""
+    font_path, web_font_path, flavor = task
+    start = time.perf_counter()
+    # テーブルの内容は変えずに圧縮だけを行う
+    font = ttLib.TTFont(font_path, recalcBBoxes=False, recalcTimestamp=False)
+    font.flavor = flavor
+    os.makedirs(os.path.dirname(web_font_path), exist_ok=True)
+    font.save(web_font_path)
+    font.close()
+    return (
+        font_path,
+        web_font_path,
+        flavor,
+        os.path.getsize(font_path),
+        os.path.getsize(web_font_path),
+        time.perf_counter() - start,
+    )
+
+
+if __name__ == "__main__":
+    main()